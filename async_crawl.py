@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import time
+import math
+import asyncio
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+import aiohttp
+import page_parser
+import sink
+import dedup
+import http_engine
+import rate_control
+import planner
+
+# 基于asyncio的爬取方式：多个期刊同时在途，由全局并发上限和每个主机的信号量限制并发，html解析在进程池中执行
+# 请求参数与解析方式与http_engine相同，检索结果超过http_engine.MAX_NUM_PAPERS时与http_engine相同地二分年份范围、按月细分
+MAX_CONCURRENCY = 32  # 全局同时进行的请求数
+PER_HOST = 8  # 每个主机同时进行的请求数
+
+# 解析一页结果，返回(总数, 翻页所需的检索语句, 文献列表)，在进程池中执行
+def parse_page(html):
+    return page_parser.parse_total(html), http_engine.parse_search_sql(html), page_parser.parse_grid(html)
+
+class AsyncCrawler(object):
+    def __init__(self, concurrency=MAX_CONCURRENCY, per_host=PER_HOST):
+        self.global_sem = asyncio.Semaphore(concurrency)
+        self.per_host = per_host
+        self.host_sems = {}
+        self.executor = ProcessPoolExecutor()
+        self.connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+
+    def host_sem(self, address):
+        host = urlparse(address).netloc
+        if host not in self.host_sems:
+            self.host_sems[host] = asyncio.Semaphore(self.per_host)
+        return self.host_sems[host]
+
+    # 请求一页检索结果，返回html，失败返回None
+    async def fetch_page(self, session, journal, start_year, end_year, page, search_sql='', months=None):
+        address = http_engine.url + http_engine.grid_path
+        form = http_engine.build_form(journal, start_year, end_year, page, search_sql, months)
+        timeout = aiohttp.ClientTimeout(total=http_engine.WAIT_SECONDS)
+        # 由速率控制器决定请求间隔，并根据响应时间与失败情况调整
+        await asyncio.sleep(rate_control.controller.reserve())
+        try:
+            async with self.global_sem, self.host_sem(address):
+                request_time = time.time()
+                async with session.post(address, data=form, timeout=timeout) as response:
+                    response.raise_for_status()
+                    html = await response.text(encoding='utf-8')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            rate_control.controller.record(ok=False)
+            print('{}. Journal: {}, year: {} - {}, page: {}.'.format(str(e) or type(e).__name__, journal, start_year, end_year, page))
+            return None
+        rate_control.controller.record(time.time() - request_time)
+        return html
+
+    # 与http_engine.start_crawl相同的爬取流程，每个任务使用独立的cookie，共享连接池
+    async def start_crawl(self, journal, start_year, end_year, output_file):
+        print('Start crawling papers from {} published during {} - {}'.format(journal, start_year, end_year))
+        output = sink.RowSink(output_file, page_size=http_engine.PAGE_SIZE, dedup=dedup.get_store(), task=(journal, start_year, end_year))
+        plan = planner.Planner(None, None, output, http_engine.PAGE_SIZE, http_engine.MAX_NUM_PAPERS, month_facets=True)
+        try:
+            async with aiohttp.ClientSession(connector=self.connector, connector_owner=False, headers=http_engine.headers) as session:
+                seg = planner.segment(start_year, end_year)
+                first = await self.search(session, journal, seg)
+                if first is None:
+                    return False
+                if not await self.crawl_segment(session, journal, seg, first, output, plan):
+                    return False
+        finally:
+            output.close()
+        ok = output.commit()
+        print('Finish crawling papers from {} published in year: {} - {}, number of papers: {}, duplicates dropped: {}, expected number: {}, sub-queries: {}'.format(
+            journal, start_year, end_year, output.rows, output.dropped, first[0], plan.leaves))
+        return ok
+
+    # 检索范围seg并取得第一页，返回(总数, 翻页所需的检索语句, 第一页的文献列表)，失败返回None
+    async def search(self, session, journal, seg):
+        html = await self.fetch_page(session, journal, seg[0], seg[1], 1, months=seg[2:])
+        if html is None:
+            return None
+        first = await asyncio.get_running_loop().run_in_executor(self.executor, parse_page, html)
+        if first[0] is None:
+            print('Paper number not found. Journal: {}, year: {}.'.format(journal, planner.describe(seg)))
+            return None
+        return first
+
+    # 按plan(planner.Planner)的规划爬取检索范围seg：结果超过上限时递归二分(单一年份时按月)，按顺序爬取每个子范围，
+    # 跳过检查点之前已完成的子范围并从中断的页继续，first为seg的检索结果
+    async def crawl_segment(self, session, journal, seg, first, output, plan):
+        total, search_sql, rows = first
+        parts = plan.bisect(seg, total)
+        if parts is not None:
+            for part in parts:
+                part_first = await self.search(session, journal, part)
+                if part_first is None or not await self.crawl_segment(session, journal, part, part_first, output, plan):
+                    return False
+            return True
+        first_page = plan.leaf(seg, total)
+        if first_page is None:
+            return True
+        # 每页解析后立即在线程池中追加写入输出文件，第一页已在检索时取得
+        loop = asyncio.get_running_loop()
+        if first_page == 1:
+            await loop.run_in_executor(None, output.write, rows)
+            first_page = 2
+        for page in range(first_page, math.ceil(total / http_engine.PAGE_SIZE) + 1):
+            html = await self.fetch_page(session, journal, seg[0], seg[1], page, search_sql, months=seg[2:])
+            if html is None:
+                return False
+            rows = await loop.run_in_executor(self.executor, page_parser.parse_grid, html)
+            await loop.run_in_executor(None, output.write, rows)
+        return True
+
+    async def close(self):
+        await self.connector.close()
+        self.executor.shutdown()
+
+# 并发执行tasks中的任务(与crawl.build_tasks生成的任务相同)，输出进度，返回成功与失败数量
+async def run(tasks, concurrency=MAX_CONCURRENCY, per_host=PER_HOST, skipped=0, start_time=None, ledger=None):
+    start_time = start_time or time.time()
+    crawler = AsyncCrawler(concurrency, per_host)
+    cnt, total = skipped, len(tasks) + skipped
+    succeed = failed = 0
+
+    # 同时在途的任务数不超过全局并发上限
+    task_sem = asyncio.Semaphore(concurrency)
+
+    async def run_task(task):
+        async with task_sem:
+            if ledger is not None:
+                ledger.start(*task[:3])
+            task_start = time.time()
+            try:
+                ok = await crawler.start_crawl(*task)
+            except Exception as e:
+                print('Unexpected error: {}. Task: {}.'.format(str(e), task))
+                ok = False
+            if ledger is not None:
+                ledger.finish(*task, ok, time.time() - task_start)
+            return ok
+
+    try:
+        for future in asyncio.as_completed([run_task(task) for task in tasks]):
+            if await future:
+                succeed += 1
+            else:
+                failed += 1
+            cnt += 1
+            print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}, {}'.format(
+                cnt, total, succeed, failed, skipped, time.time() - start_time, rate_control.status()))
+    finally:
+        await crawler.close()
+    return succeed, failed
+
+def run_tasks(tasks, concurrency=MAX_CONCURRENCY, per_host=PER_HOST, skipped=0, start_time=None, ledger=None):
+    return asyncio.run(run(tasks, concurrency, per_host, skipped, start_time, ledger))
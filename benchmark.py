@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import shutil
+import tempfile
+import resource
+import argparse
+import threading
+import functools
+import mock_server
+import scheduler
+import http_engine
+import crawl
+import telemetry
+from browser_pool import BrowserPool
+from ledger import count_rows
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 吞吐量基准测试：启动生成的替身知网(mock_server.MockSite)，用指定的爬取方式爬取若干期刊，输出
+# 任务数/小时、页数/秒、每篇文献的WebDriver命令数、峰值内存与浏览器启动开销，可保存结果并与基线比较
+# 除以下参数外的参数原样传给crawl.py(如 --extract html、--workers 2、--min-delay 0.01)
+
+# 记录浏览器启动次数与耗时，并统计每个浏览器执行的WebDriver命令数(仅在当前进程中执行时有效)
+browsers = []
+launch_seconds = 0.0
+
+def timed_new_browser():
+    global launch_seconds
+    start_time = time.time()
+    browser = crawl.new_browser()
+    launch_seconds += time.time() - start_time
+    if browser is not None:
+        crawl.count_commands(browser)
+        browsers.append(browser)
+    return browser
+
+def new_pool(max_pages=0, max_rss_mb=0):
+    return BrowserPool(timed_new_browser, crawl.reset_browser, max_pages, max_rss_mb)
+
+# 后台线程定期采样当前进程及其所有子进程(包括浏览器)的内存占用，没有psutil时使用getrusage的峰值
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.5):
+        super(RssSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if psutil is None:
+            return
+        proc = psutil.Process()
+        while not self.stopped.wait(self.interval):
+            try:
+                procs = [proc] + proc.children(recursive=True)
+                self.peak = max(self.peak, sum(p.memory_info().rss for p in procs))
+            except psutil.Error:
+                pass
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if psutil is None:
+            # ru_maxrss在Linux上以KB为单位
+            usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            self.peak = usage * 1024
+        return self.peak / (1024 * 1024)
+
+def parse_args():
+    parser = argparse.ArgumentParser(usage='python3 benchmark.py [options] [crawl.py options]')
+    parser.add_argument('--journals', type=int, default=4, help='爬取的期刊数')
+    parser.add_argument('--years', default='2012-2014', help='每个期刊的年份范围，多个范围以逗号分隔，如2012-2014,2015-2017')
+    parser.add_argument('--papers-per-year', type=int, default=300, help='替身知网中每个期刊每年的平均文献数')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次检索请求的延迟(秒)')
+    parser.add_argument('--captcha-after', type=int, default=0, help='翻页超过该篇数时出现验证码，0表示不限制')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='每次请求随机出现验证码的概率')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='每次请求随机超时的概率')
+    parser.add_argument('--fault-timeout', type=float, default=20.0, help='注入的超时请求在该秒数后返回错误')
+    parser.add_argument('--save', default=None, help='将结果保存为json文件，作为之后比较的基线')
+    parser.add_argument('--baseline', default=None, help='与之前保存的基线结果比较')
+    return parser.parse_known_args()
+
+def main():
+    args, crawl_argv = parse_args()
+    site = mock_server.MockSite(args.papers_per_year, args.latency, args.captcha_after, args.captcha_rate,
+                                args.timeout_rate, args.fault_timeout)
+    server, address = mock_server.start_server(None, site=site)
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    crawl_args = crawl.parse_args(['--url', address, '--counts-dir', os.path.join(work_dir, 'counts'), '--dedup', '',
+                                   '--merge-dir', ''] + crawl_argv)
+    crawl.configure(crawl_args)
+
+    years = [tuple(int(year) for year in years.split('-')) for years in args.years.split(',')]
+    tasks = [('J{}'.format(i), start_year, end_year, os.path.join(work_dir, 'J{}{}.csv'.format(i, j + 1)))
+             for i in range(args.journals) for j, (start_year, end_year) in enumerate(years)]
+
+    sampler = RssSampler()
+    sampler.start()
+    start_time = time.time()
+    if crawl_args.engine == 'async':
+        import async_crawl
+        succeed, failed = async_crawl.run_tasks(tasks, crawl_args.concurrency, crawl_args.per_host, 0, start_time)
+    elif crawl_args.engine == 'http':
+        succeed, failed = scheduler.run_tasks(tasks, http_engine.start_crawl, crawl_args.workers, None, 0, start_time,
+                                              init=functools.partial(crawl.configure, crawl_args))
+    else:
+        make_pool = functools.partial(new_pool, max_pages=crawl_args.recycle_pages, max_rss_mb=crawl_args.recycle_rss)
+        succeed, failed = scheduler.run_tasks(tasks, crawl.start_crawl, crawl_args.workers, make_pool, 0, start_time,
+                                              init=functools.partial(crawl.configure, crawl_args))
+    elapsed = time.time() - start_time
+    peak_rss = sampler.stop()
+    server.shutdown()
+
+    rows = sum(count_rows(task[3]) or 0 for task in tasks)
+    # 每次翻页(selenium方式)或每次请求(http方式)的平均耗时与传输字节数，来自当前进程的计时
+    turn = telemetry.telemetry.stats.get('page_wait') or telemetry.telemetry.stats.get('fetch')
+    page_bytes = telemetry.telemetry.counters.get('page_bytes')
+    # 多进程时浏览器在子进程中启动，命令数与启动开销无法统计
+    in_process = crawl_args.engine == 'selenium' and crawl_args.workers <= 1
+    commands = sum(getattr(browser, 'command_count', 0) for browser in browsers)
+    result = {
+        'engine': crawl_args.engine,
+        'extract': crawl_args.extract,
+        'tasks': len(tasks),
+        'succeed': succeed,
+        'failed': failed,
+        'rows': rows,
+        'pages': site.pages,
+        'captchas': site.captchas,
+        'timeouts': site.timeouts,
+        'seconds': round(elapsed, 3),
+        'tasks_per_hour': round(succeed / elapsed * 3600, 1),
+        'pages_per_sec': round(site.pages / elapsed, 2),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'commands_per_row': round(commands / rows, 3) if in_process and rows else None,
+        'browser_launches': len(browsers) if in_process else None,
+        'launch_seconds': round(launch_seconds, 3) if in_process else None,
+        'launch_share': round(launch_seconds / elapsed, 3) if in_process else None,
+        'peak_rss_mb': round(peak_rss, 1),
+        'page_latency': round(turn[1] / turn[0], 4) if turn else None,
+        'kb_per_page': round(page_bytes / 1024 / turn[0], 1) if turn and page_bytes is not None else None,
+    }
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    print('Benchmark result:')
+    for key, value in result.items():
+        print('  {}: {}'.format(key, 'n/a' if value is None else value))
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print('Compared with baseline {}:'.format(args.baseline))
+        for key, value in result.items():
+            base = baseline.get(key)
+            if isinstance(value, (int, float)) and isinstance(base, (int, float)) and base:
+                print('  {}: {} -> {} ({:+.1f}%)'.format(key, base, value, (value - base) / base * 100))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
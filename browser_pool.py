@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 浏览器池：工作进程串行执行任务，池中保持一个已打开高级检索页面的浏览器，任务之间复用，避免每个任务都冷启动浏览器
+# factory()返回一个新的已就绪浏览器(失败返回None)，reset(browser)将浏览器重置回高级检索页面(失败返回False)
+class BrowserPool(object):
+    def __init__(self, factory, reset, max_pages=0, max_rss_mb=0):
+        self.factory = factory
+        self.reset = reset
+        self.max_pages = max_pages    # 每个浏览器最多翻页数，超过后回收，0表示不限制
+        self.max_rss_mb = max_rss_mb  # 每个浏览器最大内存占用(MB)，超过后回收，0表示不限制
+        self.idle = None
+        self.pages = 0
+        self.launches = self.tasks = self.recycled = 0
+        if self.max_rss_mb and psutil is None:
+            print('psutil is not installed, RSS limit of browser pool is ignored.')
+
+    # 取出空闲的浏览器，没有时启动新浏览器(失败返回None)
+    def acquire(self):
+        if self.idle is not None:
+            browser, self.idle = self.idle, None
+            self.tasks += 1
+            return browser
+        browser = self.factory()
+        if browser is not None:
+            self.launches += 1
+            self.tasks += 1
+            self.pages = 0
+        return browser
+
+    # 归还浏览器：任务失败、翻页数或内存超限、重置失败时关闭浏览器，否则重置后放回池中
+    def release(self, browser, pages=0, discard=False):
+        self.pages += pages
+        reason = None
+        try:
+            if discard:
+                reason = 'task failed'
+            elif self.max_pages and self.pages >= self.max_pages:
+                reason = 'served {} pages'.format(self.pages)
+            elif self.max_rss_mb and self.rss_mb(browser) >= self.max_rss_mb:
+                reason = 'rss over {} MB'.format(self.max_rss_mb)
+            elif not self.reset(browser):
+                reason = 'reset failed'
+        except Exception as e:
+            # 重置时浏览器抛出的异常(如页面加载超时)同样视为重置失败，保证浏览器被关闭
+            reason = 'reset failed: {}'.format(str(e).strip())
+
+        if reason is None:
+            self.idle = browser
+            return
+
+        print('Recycle browser: {}.'.format(reason))
+        self.recycled += 1
+        self.quit(browser)
+
+    # 浏览器驱动进程及其所有子进程(浏览器本身)占用的内存(MB)
+    def rss_mb(self, browser):
+        if psutil is None:
+            return 0
+        try:
+            proc = psutil.Process(browser.service.process.pid)
+            procs = [proc] + proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs) / (1024 * 1024)
+        except (AttributeError, psutil.Error):
+            return 0
+
+    def quit(self, browser):
+        try:
+            browser.quit()
+        except Exception as e:
+            print(str(e))
+
+    # 关闭池中空闲的浏览器
+    def close(self):
+        browser, self.idle = self.idle, None
+        if browser is not None:
+            self.quit(browser)
+
+    def summary(self):
+        return summary(self.tasks, self.launches, self.recycled)
+
+# 浏览器池的统计，多个工作进程的统计相加后同样用此输出
+def summary(tasks, launches, recycled):
+    return 'Browser pool: tasks: {}, launches: {}, launches avoided: {}, recycled: {}'.format(
+        tasks, launches, tasks - launches, recycled)
@@ -6,46 +6,48 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import TimeoutException
 from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import WebDriverException
 import pandas as pd
 import time
+import math
 import random
 from collections import OrderedDict
 import sys
 import os
-from pathlib import Path
+import argparse
 import utils
-import requests
+import page_parser
+import sink
+import dedup
+import http_engine
+from browser_pool import BrowserPool
+from ledger import Ledger
+from proxy_pool import ProxyManager
+import scheduler
+import telemetry
+import rate_control
+import planner
+import functools
+import postprocess
+import enrich
+import response_cache
 
-# 用于记录屏幕输出
-class Logger(object):
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 用于记录屏幕输出，日志文件由后台线程写入
+class Logger(telemetry.Logger):
     def __init__(self, filename="crawl.log"):
-        self.terminal = sys.stdout
-        self.log = open(filename, "a")
- 
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
- 
-    def flush(self):
-        pass
-sys.stdout = Logger()
-
-def get_proxy():
-    return requests.get("http://127.0.0.1:5010/get/").json()
-
-def delete_proxy(proxy):
-    requests.get("http://127.0.0.1:5010/delete/?proxy={}".format(proxy))
-
-def check_proxy(proxy):
-    proxy = get_proxy().get("proxy")
-    ok = True
-    try:
-        requests.get('http://httpbin.org/ip', proxies={"http": "http://{}".format(proxy)})
-    except Exception:
-        ok = False
-    # 删除代理池中代理
-    delete_proxy(proxy)
-    return ok
+        super(Logger, self).__init__(filename)
+
+# 每个进程共用一个代理管理器，首次使用时启动后台验证
+def get_proxy_manager():
+    global proxy_manager, proxy_api
+    if proxy_manager is None:
+        proxy_manager = ProxyManager(proxy_api).start()
+    return proxy_manager
 
 # 将每三位以逗号分隔的字符串表示的数字转换成阿拉伯数字
 def str2int(s):
@@ -64,98 +66,415 @@ def check_date(y, start, end):
 
 url = 'https://chn.oversea.cnki.net/'
 WAIT_SECONDS = 15
-MAX_NUM_PAPERS = 1500
+MAX_NUM_PAPERS = planner.MAX_NUM_PAPERS
+extract_mode = 'script'  # 结果表格提取方式: script, html, element
+counts_dir = './publish_numbers_parts'  # 各任务的发表数量保存目录，为空时不读取发表数量
+# 判断验证码是否出现的脚本
+CAPTCHA_SCRIPT = "var e = document.querySelector('#verifyCode, .verify-wrap, #ChDivVerify'); return !!(e && e.offsetParent);"
+
+use_proxy = False  # 是否使用代理
+proxy_api = 'http://127.0.0.1:5010/'  # 代理池接口地址
+proxy_manager = None
 
 type_browser = 'chrome'  # 浏览器类型(目前仅支持chrome和firefox)
 # 浏览器驱动路径
 path_firefox_driver = '/home/panda/Downloads/geckodriver'
 path_chrome_driver = r'C:\Program Files (x86)\Google\Chrome\Application\chromedriver.exe'
 
-def get_browser(type_browser, headless=False, use_proxy=False):
-    global path_firefox_driver, path_chrome_driver
+# 精简浏览器配置：无头模式，eager页面加载策略(DOM就绪即返回，不等待图片等资源)，屏蔽图片、字体、媒体与统计脚本，
+# 磁盘缓存保存在browser_cache_dir中，之后启动的浏览器(包括之后的运行)继续使用，只读取gridTable与countPageDiv的文字不受影响
+lean = False
+browser_cache_dir = './browser_cache'
+# 精简模式下屏蔽的请求(DevTools协议Network.setBlockedURLs的通配符)
+BLOCKED_URLS = [
+    '*.png*', '*.jpg*', '*.jpeg*', '*.gif*', '*.svg*', '*.ico*', '*.webp*', '*.bmp*',
+    '*.woff*', '*.ttf*', '*.otf*', '*.eot*',
+    '*.mp4*', '*.mp3*', '*.webm*', '*.ogg*', '*.swf*',
+    '*google-analytics.com*', '*googletagmanager.com*', '*hm.baidu.com*', '*cnzz.com*', '*growingio.com*',
+]
+page_fetch = 'click'  # 翻页方式：click为逐页点击下一页，http为沿用浏览器的会话直接请求结果表格接口(可并发)
+reuse_search = False  # 任务之间保留已打开的高级检索页面(与每页50篇的设置)，只重新填写期刊名与年份并检索，不重新打开页面
+page_stats = False  # 是否统计每次翻页传输的字节数(每页多执行一次WebDriver命令)
+# 返回上次调用以来页面请求的资源传输的字节数(命中缓存的资源为0)，并清空已记录的资源
+PAGE_BYTES_SCRIPT = '''
+var entries = performance.getEntriesByType('resource'), total = 0;
+for (var i = 0; i < entries.length; i++) {
+    total += entries[i].transferSize || 0;
+}
+performance.clearResourceTimings();
+return total;
+'''
+
+# 为浏览器分配一个未被占用的缓存目录：同时运行的多个浏览器不能共用同一个磁盘缓存，
+# 用文件锁在cache_dir下的0、1、2...中选择，返回目录与锁文件，浏览器关闭后释放锁
+def cache_slot(cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    if fcntl is None:
+        return os.path.abspath(os.path.join(cache_dir, str(os.getpid()))), None
+    i = 0
+    while True:
+        lock = open(os.path.join(cache_dir, '{}.lock'.format(i)), 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return os.path.abspath(os.path.join(cache_dir, str(i))), lock
+        except OSError:
+            lock.close()
+            i += 1
+
+# 设置精简模式的浏览器启动参数，cache为磁盘缓存目录(无头模式由get_browser的headless参数设置)
+def lean_options(options, type_browser, cache):
+    options.set_capability('pageLoadStrategy', 'eager')
+    if type_browser == 'firefox':
+        # firefox不支持DevTools协议屏蔽请求，通过首选项禁止图片、网络字体与自动播放
+        options.set_preference('permissions.default.image', 2)
+        options.set_preference('gfx.downloadable_fonts.enabled', False)
+        options.set_preference('media.autoplay.default', 5)
+        options.set_preference('browser.cache.disk.parent_directory', cache)
+    else:
+        options.add_argument('--disk-cache-dir=' + cache)
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+# 浏览器启动后的精简设置：chrome通过DevTools协议屏蔽BLOCKED_URLS中的请求，浏览器关闭时释放缓存目录的锁
+def lean_browser(browser, lock):
+    if isinstance(browser, webdriver.Chrome):
+        browser.execute_cdp_cmd('Network.enable', {})
+        browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+    if lock is None:
+        return
+    quit = browser.quit
+
+    def quit_and_unlock():
+        try:
+            quit()
+        finally:
+            lock.close()
+    browser.quit = quit_and_unlock
+
+# 启动浏览器，lean为True时使用精简配置
+def get_browser(type_browser, headless=False, use_proxy=False, lean=False):
+    global path_firefox_driver, path_chrome_driver, browser_cache_dir
     browser = None
+    cache, lock = cache_slot(browser_cache_dir) if lean else (None, None)
 
     if type_browser == 'firefox':
         from selenium.webdriver.firefox.options import Options
         options = Options()
         if headless:
             options.add_argument('--headless')  
+        if lean:
+            lean_options(options, type_browser, cache)
         browser = webdriver.Firefox(options=options, executable_path=path_firefox_driver) 
     elif type_browser == 'chrome':
         from selenium.webdriver.chrome.options import Options
         options = Options()
         if headless:
             options.add_argument('--headless')
+        if lean:
+            lean_options(options, type_browser, cache)
         options.add_argument('--no-sandbox')
         options.add_argument('start-maximized')
         options.add_argument('--disable-gpu')
         options.add_argument('--disable-infobars')
         options.add_argument('--disable-extentions')
         if use_proxy:
-            proxy = get_proxy().get('proxy')
-            while not check_proxy(proxy):
-                proxy = get_proxy().get('proxy')
+            proxy = get_proxy_manager().get()
+            if proxy is None:
+                print('No healthy proxy available.')
+                if lock is not None:
+                    lock.close()
+                return None
             print('Using proxy: {}'.format(proxy))
             options.add_argument('--proxy-server=%s' % proxy)
         browser = webdriver.Chrome(options=options, executable_path=path_chrome_driver)
+        browser.proxy = proxy if use_proxy else None  # 速率控制按代理分别计算翻页间隔
         
+    if browser is not None and lean:
+        lean_browser(browser, lock)
     return browser
 
-def start_crawl(journal, start_year, end_year, output_file):
-    global type_browser, url, WAIT_SECONDS, MAX_NUM_PAPERS
-    print('Start crawling papers from {} published during {} - {}'.format(journal, start_year, end_year))
+# 打开首页，进入高级检索页面并切换到学术期刊，成功返回True
+def open_search(browser):
+    global url, WAIT_SECONDS
+    with telemetry.span('search_page_load'):
+        browser.get(url)
+
+        # 等待高级检索按键加载完成并点击
+        try:
+            a_high_search = WebDriverWait(browser, WAIT_SECONDS).until(
+                EC.element_to_be_clickable(
+                    (By.LINK_TEXT, '高级检索')
+                )
+            )
+        except TimeoutException as e:
+            print('Timeout during waiting for loading of high search buttom.')
+            return False
+        a_high_search.click()
+        time.sleep(1)
 
-    browser = get_browser(type_browser, headless=False, use_proxy=False)
-    browser.get(url)
+        # 切换到最新打开的窗口
+        windows = browser.window_handles
+        browser.switch_to.window(windows[-1])
 
-    # 等待高级检索按键加载完成并点击
-    try:
-        a_high_search = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.element_to_be_clickable(
-                (By.LINK_TEXT, '高级检索')
+        # 找到文献来源标签，用于后面判断点击刷新完成
+        try:
+            span_src = browser.find_element_by_xpath('//*[@id="gradetxt"]/dd[3]/div[2]/div[1]/div[1]/span')
+        except NoSuchElementException as e:
+            print(str(e))
+            return False
+
+    with telemetry.span('journal_type_refresh'):
+        # 等待学术期刊按键加载完成并点击
+        try:
+            span_journal = WebDriverWait(browser, WAIT_SECONDS).until(
+                EC.element_to_be_clickable(
+                    (By.XPATH, '//ul[@class="doctype-menus keji"]/li[@data-id="xsqk"]/a/span')
+                )
             )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for loading of high search buttom.')
-        browser.quit()
+        except TimeoutException as e:
+            print('Timeout during waiting for loading of journal buttom.')
+            return False
+        browser.execute_script('arguments[0].click();', span_journal)
+
+        # 通过文献来源标签的过期判断刷新完成
+        try:
+            WebDriverWait(browser, WAIT_SECONDS).until(
+                EC.staleness_of(span_src)
+            )
+        except TimeoutException as e:
+            print('Timeout during refresh after clicking journal buttom')
+            return False
+    return True
+
+# 启动浏览器并打开高级检索页面，失败返回None
+def new_browser():
+    global type_browser, use_proxy, lean
+    with telemetry.span('browser_launch', lean=lean):
+        browser = get_browser(type_browser, headless=lean, use_proxy=use_proxy, lean=lean)
+    if browser is None:
+        return None
+    try:
+        ready = open_search(browser)
+    except Exception as e:
+        print(str(e))
+        ready = False
+    if not ready:
+        try:
+            browser.quit()
+        except Exception as e:
+            print(str(e))
+        return None
+    return browser
+
+# 检查浏览器是否仍停留在可以直接重新检索的高级检索页面上(期刊名输入框存在且没有验证码)
+def search_ready(browser):
+    try:
+        if not browser.find_elements_by_xpath('//*[@id="gradetxt"]/dd[3]/div[2]/input'):
+            return False
+    except WebDriverException as e:
+        print(str(e))
+        return False
+    return not has_captcha(browser)
+
+# 供浏览器池在任务之间重置浏览器：reuse_search为True且当前页面仍可直接检索时不重新打开页面，
+# 下一个任务在同一页面中重新填写期刊名与年份，否则重新打开高级检索页面
+def reset_browser(browser):
+    global reuse_search
+    with telemetry.span('browser_reset') as attrs:
+        attrs['reused'] = reuse_search and search_ready(browser)
+        if attrs['reused']:
+            return True
+        return renavigate(browser)
+
+# 关闭高级检索打开的多余窗口，并重新打开高级检索页面
+def renavigate(browser):
+    try:
+        windows = browser.window_handles
+        for window in windows[1:]:
+            browser.switch_to.window(window)
+            browser.close()
+        browser.switch_to.window(windows[0])
+    except Exception as e:
+        print(str(e))
         return False
-    a_high_search.click()
-    time.sleep(1)
+    return open_search(browser)
+
+# 创建浏览器池：工作进程串行执行任务，每个进程保持一个已打开高级检索页面的浏览器，需要多个浏览器时增加--workers
+def new_pool(max_pages=0, max_rss_mb=0):
+    return BrowserPool(new_browser, reset_browser, max_pages=max_pages, max_rss_mb=max_rss_mb)
 
-    # 切换到最新打开的窗口
-    windows = browser.window_handles
-    browser.switch_to.window(windows[-1])
+# 统计浏览器执行的WebDriver命令数(每条命令对应一次与浏览器驱动的HTTP往返)，结果记录在browser.command_count中
+def count_commands(browser):
+    if hasattr(browser, 'command_count'):
+        return
+    browser.command_count = 0
+    execute = browser.execute
+
+    def counted_execute(driver_command, params=None):
+        browser.command_count += 1
+        return execute(driver_command, params)
+    browser.execute = counted_execute
 
-    # 找到文献来源标签，用于后面判断点击刷新完成
+# 逐个元素提取当前页结果表格中的文献信息，每篇文献约需7次WebDriver命令
+def extract_elements(browser):
+    # 文献信息保存在表格中，表格的一行(tr)对应一篇文献信息
     try:
-        span_src = browser.find_element_by_xpath('//*[@id="gradetxt"]/dd[3]/div[2]/div[1]/div[1]/span')
+        trs = browser.find_elements_by_xpath('//*[@id="gridTable"]/table/tbody/tr')
     except NoSuchElementException as e:
         print(str(e))
-        browser.quit()
+        return None
+    result = []
+    for tr in trs:
+        # 表格的一列(td)对应一篇文献的特定信息，如篇名、作者
+        try:
+            tds = tr.find_elements_by_tag_name('td')
+        except NoSuchElementException as e:
+            print(str(e))
+            return None
+        values = []
+        for col in page_parser.cols:
+            if col not in page_parser.link_cols:
+                values.append(tds[page_parser.col2index[col]].text)
+                continue
+            try:
+                a = tds[page_parser.col2index[col]].find_element_by_tag_name('a')
+            except NoSuchElementException as e:
+                values.append('')
+                continue
+            values.append(a.text)
+        result.append(page_parser.to_row(values))
+    return result
+
+# 提取当前页的所有文献信息，失败返回None
+# extract_mode为script时通过一次execute_script取回整个表格，为html时取一次页面源码用lxml解析，为element时逐个元素提取
+def extract_page(browser):
+    global extract_mode
+    if extract_mode == 'element':
+        return extract_elements(browser)
+    try:
+        if extract_mode == 'html':
+            return page_parser.parse_grid(browser.page_source)
+        return page_parser.parse_grid_json(browser.execute_script(page_parser.GRID_SCRIPT, page_parser.GRID_SPEC))
+    except WebDriverException as e:
+        print(str(e))
+        return None
+
+# 爬取期刊journal在start_year到end_year间发表的文献，保存到output_file中
+# 传入浏览器池pool时从池中取用已打开高级检索页面的浏览器，否则为本任务单独启动浏览器
+def start_crawl(journal, start_year, end_year, output_file, pool=None):
+    # 回放模式下不启动浏览器，从响应缓存中重新提取
+    if response_cache.replay:
+        return http_engine.start_crawl(journal, start_year, end_year, output_file)
+    print('Start crawling papers from {} published during {} - {}'.format(journal, start_year, end_year))
+
+    with telemetry.span('task', journal=journal, years='{}-{}'.format(start_year, end_year)) as attrs:
+        attrs['ok'] = run_crawl(journal, start_year, end_year, output_file, pool)
+        http_engine.wait_enrichment()
+    return attrs['ok']
+
+# 取用或启动浏览器并爬取一个任务，结束后归还或关闭浏览器
+def run_crawl(journal, start_year, end_year, output_file, pool):
+    with telemetry.span('browser_acquire', journal=journal):
+        browser = pool.acquire() if pool is not None else new_browser()
+    if browser is None:
+        print('Failed to start browser. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
         return False
 
-    # 等待学术期刊按键加载完成并点击
+    stats = {'pages': 0}
+    ok = False
     try:
-        span_journal = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.element_to_be_clickable(
-                (By.XPATH, '//ul[@class="doctype-menus keji"]/li[@data-id="xsqk"]/a/span')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for loading of journal buttom.')
-        browser.quit()
+        ok = crawl_papers(browser, journal, start_year, end_year, output_file, stats)
+    finally:
+        # 将任务结果反馈给代理管理器，连续失败的代理会被淘汰
+        if getattr(browser, 'proxy', None):
+            get_proxy_manager().report(browser.proxy, ok)
+        if pool is not None:
+            pool.release(browser, pages=stats['pages'], discard=not ok)
+        else:
+            browser.quit()
+    return ok
+
+# 在已打开高级检索页面的浏览器中检索并保存所有页的文献信息，stats['pages']记录翻过的页数
+# 检索结果超过MAX_NUM_PAPERS时由planner递归二分年份范围，分别爬取后写入同一输出文件
+def crawl_papers(browser, journal, start_year, end_year, output_file, stats):
+    global MAX_NUM_PAPERS
+    total = timed_search(browser, journal, start_year, end_year)
+    if total is None:
         return False
-    browser.execute_script('arguments[0].click();', span_journal)
 
-    # 通过文献来源标签的过期判断刷新完成
+    # 在同一次检索中顺便读取各年份的发表数量，不再为此单独启动浏览器检索
+    if counts_dir:
+        save_year_counts(browser, journal, start_year, end_year, total, output_file)
+
+    # 每页解析后立即追加写入输出文件
+    output = sink.RowSink(output_file, page_size=50, dedup=dedup.get_store(), task=(journal, start_year, end_year))
+
+    def search(seg):
+        return timed_search(browser, journal, seg[0], seg[1])
+
+    def crawl_leaf(seg, leaf_total, first_page):
+        if page_fetch == 'http':
+            return fetch_pages(browser, journal, seg, leaf_total, first_page, output, stats)
+        with telemetry.span('page_size', journal=journal) as attrs:
+            attrs['ok'] = set_page_size(browser, journal, seg[0], seg[1])
+        if not attrs['ok']:
+            return False
+        return crawl_pages(browser, journal, seg[0], seg[1], output, stats, first_page)
+
+    plan = planner.Planner(search, crawl_leaf, output, output.page_size, MAX_NUM_PAPERS)
     try:
-        WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.staleness_of(span_src)
-        )
-    except TimeoutException as e:
-        print('Timeout during refresh after clicking journal buttom')
-        browser.quit()
+        ok = plan.crawl(planner.segment(start_year, end_year), total)
+    finally:
+        output.close()
+    if not ok:
+        return False
+    ok = output.commit()
+
+    print('Finish crawling papers from {} published in year: {} - {}, number of papers: {}, duplicates dropped: {}, expected number: {}, sub-queries: {}'.format(
+        journal, start_year, end_year, output.rows, output.dropped, total, plan.leaves))
+    return ok
+
+# 读取当前检索结果的各年份发表数量并保存到counts_dir下与输出文件同名的csv文件中，
+# 读取失败只影响发表数量，不影响文献信息的爬取
+def save_year_counts(browser, journal, start_year, end_year, total, output_file):
+    global counts_dir
+    with telemetry.span('year_counts', journal=journal, years='{}-{}'.format(start_year, end_year)):
+        info = read_year_counts(browser, journal, start_year, end_year, total)
+    if info is None:
         return False
+    if not os.path.exists(counts_dir):
+        os.makedirs(counts_dir, exist_ok=True)
+    counts_file = os.path.join(counts_dir, os.path.splitext(os.path.basename(output_file))[0] + '.csv')
+    pd.DataFrame(data=[info]).to_csv(counts_file, index=False, encoding='utf-8')
+    return True
+
+# 计时的检索
+# 结果超过MAX_NUM_PAPERS时(之后会被二分，不会从这次检索翻页)将结果页存入响应缓存，使回放时能读取结果总数
+def timed_search(browser, journal, start_year, end_year):
+    global MAX_NUM_PAPERS
+    with telemetry.span('search_submit', journal=journal, years='{}-{}'.format(start_year, end_year)) as attrs:
+        attrs['total'] = submit_search(browser, journal, start_year, end_year)
+    if attrs['total'] is not None and attrs['total'] > MAX_NUM_PAPERS and response_cache.get_cache() is not None:
+        cache_page(browser, journal, start_year, end_year, 1)
+    return attrs['total']
+
+# 将浏览器当前显示的结果页以每页http_engine.PAGE_SIZE篇的第page页存入响应缓存，之后可由--replay回放，回放模式下不写入
+def cache_page(browser, journal, start_year, end_year, page):
+    cache = response_cache.get_cache()
+    if cache is None or cache.replay:
+        return
+    try:
+        html = browser.page_source
+    except WebDriverException as e:
+        print(str(e))
+        return
+    key, request = cache.make_key(journal, start_year, end_year, page, http_engine.PAGE_SIZE)
+    cache.put(key, request, html)
+
+# 在高级检索页面中填写期刊名、起始年与结束年并检索，返回检索结果总数，失败返回None
+# 页面上已有检索结果时先清空输入框，并等待旧的结果总数标签过期，以便在同一页面中重新检索
+def submit_search(browser, journal, start_year, end_year):
+    global WAIT_SECONDS
 
     # 等待期刊名称输入框加载完成
     try:
@@ -166,18 +485,19 @@ def start_crawl(journal, start_year, end_year, output_file):
         )
     except TimeoutException as e:
         print('Timeout during waiting for input box for jounral name.')
-        browser.quit()
-        return False
-    input_journal.send_keys(journal)  # 输入期刊名
-    time.sleep(1)
+        return None
+    if input_journal.get_attribute('value') != journal:
+        input_journal.clear()
+        input_journal.send_keys(journal)  # 输入期刊名
+        time.sleep(1)
 
     # 找到起始年输入框并输入起始年
     try:
         input_start_year = browser.find_element_by_xpath('//input[@placeholder="起始年"]')
     except NoSuchElementException as e:
         print(str(e))
-        browser.quit()
-        return False
+        return None
+    input_start_year.clear()
     input_start_year.send_keys(start_year)
 
     # 找到结束输入框并输入结束年
@@ -185,8 +505,8 @@ def start_crawl(journal, start_year, end_year, output_file):
         input_end_year = browser.find_element_by_xpath('//input[@placeholder="结束年"]')
     except NoSuchElementException as e:
         print(str(e))
-        browser.quit()
-        return False
+        return None
+    input_end_year.clear()
     input_end_year.send_keys(end_year)
 
     # 找到检索键并点击
@@ -194,12 +514,14 @@ def start_crawl(journal, start_year, end_year, output_file):
         input_search = browser.find_element_by_xpath('//input[@value="检索"]')
     except NoSuchElementException as e:
         print(str(e))
-        browser.quit()
-        return False
+        return None
+    old_totals = browser.find_elements_by_xpath('//*[@id="countPageDiv"]/span[1]/em')
     input_search.click()
 
     # 根据搜索结果总数标签的出现判断页面是否刷新完成
     try:
+        if old_totals:
+            WebDriverWait(browser, WAIT_SECONDS).until(EC.staleness_of(old_totals[0]))
         em_total = WebDriverWait(browser, WAIT_SECONDS).until(
             EC.visibility_of_element_located(
                 (By.XPATH, '//*[@id="countPageDiv"]/span[1]/em')
@@ -207,24 +529,99 @@ def start_crawl(journal, start_year, end_year, output_file):
         )
     except TimeoutException as e:
         print('Timeout during waiting for paper number cell.')
-        browser.quit()
-        return False
-        
-    '''
-    # 检查筛选后的文献总数是否超过1500条，超过1500条需要输入验证码，这里直接放弃
-    total = str2int(em_total.text)
-    if total > MAX_NUM_PAPERS:
-        print('Number of papers: {} > {}. Journal: {}, year: {} - {}.'.format(total, MAX_NUM_PAPERS, journal, start_year, end_year))
-        browser.quit()
-        return False
-    '''
+        return None
+    return str2int(em_total.text)
+
+# 读取当前检索结果的发表年度分组中start_year到end_year每年的发表数量，与结果总数expected_num一起
+# 以check_publish_numbers所需的格式(期刊名称、各年份、总数)返回，失败或数量不一致时返回None
+def read_year_counts(browser, journal, start_year, end_year, expected_num):
+    global WAIT_SECONDS
+
+    # 找到发表年度
+    try:
+        dt_year = WebDriverWait(browser, WAIT_SECONDS).until(
+            EC.element_to_be_clickable(
+                (By.XPATH, '//dt[@groupitem="发表年度"]')
+            )
+        )
+    except TimeoutException as e:
+        print('Timeout during waiting for loading of publish years list. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
+        return None
+    
+    # 将鼠标移动到发表年度，若发表年度被折叠，则点击之
+    action = ActionChains(browser).move_to_element(dt_year)
+    dt_year_parent = browser.find_element_by_xpath('//dt[@groupitem="发表年度"]/..')
+    if dt_year_parent.get_attribute('class') == 'is-up-fold off':
+        action.click().perform()  # 点击发表年度
+
+    # 让鼠标悬浮在发表年度的部分展开列表上，使其完全展开
+    try:
+        div_lst = WebDriverWait(browser, WAIT_SECONDS).until(
+            EC.visibility_of_element_located(
+                (By.XPATH, '//dd[@tit="发表年度"]/div')
+            )
+        )
+    except TimeoutException as e:
+        print('Timeout during waiting for display of complete publish years. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
+        return None
+    ActionChains(browser).move_to_element(div_lst).perform()      
+
+    info = OrderedDict()
+    info['期刊名称'] = journal
+    actual_num = 0
+    timeout = False
+    # 找到目标范围内的年份的发表数量
+    for year in range(start_year, end_year + 1):
+        if not timeout or year == 2014:
+            try:
+                span = WebDriverWait(browser, WAIT_SECONDS).until(
+                    EC.visibility_of_element_located(
+                        (By.XPATH, '//input[@type="checkbox" and @text="{0}" and @value="{0}"]/following-sibling::span'.format(str(year)))
+                    )
+                )
+            except TimeoutException as e:
+                print('No paper found for journal {0} in year {1}. Journal: {0}, year: {2} - {3}.'.format(journal, year, start_year, end_year))
+                info[str(year)] = 0
+                timeout = True
+                continue
+        else:
+            try:
+                span = browser.find_element_by_xpath('//input[@type="checkbox" and @text="{0}" and @value="{0}"]/following-sibling::span'.format(str(year)))
+            except NoSuchElementException as e:
+                print(str(e))
+                info[str(year)] = 0
+                continue
+        #print('year: {}, num: {}'.format(year, span.text))
+        num = int(span.text[1:-1])
+        info[str(year)] = num   
+        actual_num += num
+
+    # 检验九年发表数量总和是否等于筛选结果数量
+    if actual_num != expected_num:
+        print('Total number of papers conflict, expected number: {}, actual number: {}. Journal: {}, year: {} - {}.'.format(expected_num, actual_num, journal, start_year, end_year))
+        return None
     
+    info['总数'] = expected_num
+    return info
+
+# 将每页文献数设置为50，已经是50时不再设置
+def set_page_size(browser, journal, start_year, end_year):
+    global WAIT_SECONDS
+
+    # 寻找每页文献数量标签
+    try:
+        span = browser.find_element_by_id('perPageDiv').find_element_by_tag_name('span')
+    except NoSuchElementException as e:
+        print(str(e))
+        return False
+    if span.text.strip() == '50':
+        return True
+
     # 找到每页文献数标签并点击使其展开
     try:
         div_perpage = browser.find_element_by_id('perPageDiv').find_element_by_tag_name('div')
     except NoSuchElementException as e:
         print(str(e))
-        browser.quit()
         return False
     browser.execute_script("arguments[0].scrollIntoView();", div_perpage) 
     div_perpage.click()
@@ -238,17 +635,7 @@ def start_crawl(journal, start_year, end_year, output_file):
         )
     except TimeoutException as e:
         print('Timeout during waiting for loading of buttom perPageDiv. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
-        browser.quit()
         return False 
-            
-    # 寻找每页文献数量标签
-    try:
-        span = browser.find_element_by_id('perPageDiv').find_element_by_tag_name('span') 
-    except NoSuchElementException as e:
-        print(str(e))
-        browser.quit()
-        return False
-        
     li_50.click()
 
     # 通过每页文献数量标签的过期，判断文献列表刷新完成
@@ -256,58 +643,102 @@ def start_crawl(journal, start_year, end_year, output_file):
         WebDriverWait(browser, WAIT_SECONDS).until(EC.staleness_of(span))
     except TimeoutException as e:
         print('Timeout during waiting for refresh of search results after clciking buttom perPageDiv. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
-        browser.quit()
         return False
+    return True
 
-    cols = ['篇名', '作者', '期刊名称', '发表时间', '被引次数', '被下载次数'] # 需要保存的信息种类
-    col2index = {}
-    for i, col in enumerate(cols):
-        col2index[col] = i + 1
-    result = []
-    page_cnt = 0
-    # 保存所有页的文献信息
+# 检查页面上是否出现了验证码
+def has_captcha(browser):
+    try:
+        return bool(browser.execute_script(CAPTCHA_SCRIPT))
+    except WebDriverException:
+        return False
+
+# 当前页结果表格每行篇名链接的地址，失败或行数与num_rows不一致时返回空列表(本页不补充详情)
+def page_links(browser, num_rows):
+    try:
+        links = browser.execute_script(page_parser.LINK_SCRIPT, page_parser.col2index['篇名'])
+    except WebDriverException as e:
+        print(str(e))
+        return []
+    return links if len(links) == num_rows else []
+
+# 上次调用以来页面传输的字节数，失败返回0
+def page_bytes(browser):
+    try:
+        return int(browser.execute_script(PAGE_BYTES_SCRIPT) or 0)
+    except WebDriverException:
+        return 0
+
+# 跳转到第page页：每次通过一次execute_script点击可见页码中不超过page的最大页码，直到当前页为page
+JUMP_SCRIPT = '''
+var target = arguments[0], best = null, bestPage = 0;
+var links = document.querySelectorAll('a[data-curpage]');
+for (var i = 0; i < links.length; i++) {
+    var page = parseInt(links[i].getAttribute('data-curpage'));
+    if (page <= target && page > bestPage) {
+        best = links[i];
+        bestPage = page;
+    }
+}
+if (best) {
+    best.click();
+}
+return bestPage;
+'''
+
+def goto_page(browser, page):
+    global WAIT_SECONDS
     while True:
-        page_cnt +=1
-        # 文献信息保存在表格中，表格的一行(tr)对应一篇文献信息
         try:
-            trs = browser.find_elements_by_xpath('//*[@id="gridTable"]/table/tbody/tr')
-        except NoSuchElementException as e:                         
+            span = browser.find_element_by_xpath('//span[@class="cur"]')
+            cur = int(span.text)
+        except (NoSuchElementException, ValueError) as e:
             print(str(e))
-            browser.quit()
             return False
-        # 保存当前页的所有文献信息
-        for tr in trs:
-            # 表格的一列(td)对应一篇文献的特定信息，如篇名、作者
-            try: 
-                tds = tr.find_elements_by_tag_name('td')
-            except NoSuchElementException as e:
-                print(str(e))
-                browser.quit()
-                return False
-            '''
-            # 检查期刊名是否符合预期(可能模糊匹配)
-            if not(tds[3].text == journal or tds[3].text.startswith(journal + '(')):
-                print('Actual source: {}, expected source: {}'.format(tds[3].text, journal))
-                continue
-            # 检查发表时间是否符合预期
-            y = int(tds[4].text.split('-')[0])
-            if not check_date(y, start_year, end_year):
-                print('Actual year: {}, expected year: {} - {}. Journal: {}, year: {} - {}.'.format(y, start_year, end_year, journal, start_year, end_year))
-                continue
-            '''
-            info = OrderedDict()
-            info['时间段'] = '2012-2020'
-            for col in cols:
-                if col == '发表时间':
-                    info[col] = tds[col2index[col]].text
-                else:
-                    try:
-                        a = tds[col2index[col]].find_element_by_tag_name('a')
-                    except NoSuchElementException as e:
-                        info[col] = ''
-                        continue
-                    info[col] = a.text
-            result.append(info)
+        if cur == page:
+            return True
+        if browser.execute_script(JUMP_SCRIPT, page) <= cur:
+            return False
+
+        # 通过当前页码标签判断页面是否刷新
+        try:
+            WebDriverWait(browser, WAIT_SECONDS).until(EC.staleness_of(span))
+        except TimeoutException as e:
+            print('Timeout during waiting for refresh of current page after jumping to page {}.'.format(page))
+            return False
+
+# 从第first_page页开始逐页提取文献信息并写入output，直到没有下一页
+def crawl_pages(browser, journal, start_year, end_year, output, stats, first_page=1):
+    global WAIT_SECONDS, extract_mode
+    # 有检查点时直接跳转到上次完成的页之后继续
+    if first_page > 1 and not goto_page(browser, first_page):
+        print('Failed to jump to page {}. Journal: {}, year: {} - {}.'.format(first_page, journal, start_year, end_year))
+        return False
+    page_cnt = first_page - 1
+    count_commands(browser)
+    commands_before, extract_commands = browser.command_count, 0
+    turns, turn_seconds, turn_bytes = 0, 0.0, 0
+    if page_stats:
+        page_bytes(browser)
+    cache = response_cache.get_cache()
+    # 保存所有页的文献信息
+    while True:
+        page_cnt +=1
+        stats['pages'] += 1
+        # 提取当前页的所有文献信息
+        extract_before = browser.command_count
+        with telemetry.span('extract', journal=journal, page=page_cnt):
+            rows = extract_page(browser)
+        if rows is None:
+            return False
+        extract_commands += browser.command_count - extract_before
+        if cache is not None:
+            cache_page(browser, journal, start_year, end_year, page_cnt)
+        details = enrich.get_enricher()
+        if details is not None:
+            details.submit(rows, page_links(browser, len(rows)))
+        with telemetry.span('write', journal=journal, page=page_cnt):
+            output.write(rows)
 
         # 寻找下一页按键
         try:
@@ -319,38 +750,162 @@ def start_crawl(journal, start_year, end_year, output_file):
         except TimeoutException:
             break
 
+        # 由速率控制器决定翻页间隔，使用代理时同时受该代理的间隔限制
+        proxy = getattr(browser, 'proxy', None)
+        with telemetry.span('rate_wait'):
+            rate_control.controller.wait(proxy)
+
         # 将鼠标拖动到下一页按键附近并点击
         browser.execute_script("arguments[0].scrollIntoView();", next_page) 
         span = browser.find_element_by_xpath('//span[@class="cur"]')
+        click_time = time.time()
         ActionChains(browser).move_to_element(next_page).click().perform()
         
-        # 30页必出验证码
-        if (page_cnt % 30)== 0:
-            time.sleep(15)
-        
-        # 通过当前页码标签判断页面是否刷新
+        # 通过当前页码标签判断页面是否刷新，超时或出现验证码时降低翻页速率
         try:
-            WebDriverWait(browser, WAIT_SECONDS).until(EC.staleness_of(span))  
+            with telemetry.span('page_wait', journal=journal, page=page_cnt + 1):
+                WebDriverWait(browser, WAIT_SECONDS).until(EC.staleness_of(span))
         except TimeoutException as e:
-            print('Timeout during waiting for refresh of current page after clicking next page. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
-            browser.quit()
+            captcha = has_captcha(browser)
+            rate_control.controller.record(ok=False, captcha=captcha, key=proxy)
+            print('Timeout during waiting for refresh of current page after clicking next page{}. Journal: {}, year: {} - {}.'.format(
+                ' (captcha)' if captcha else '', journal, start_year, end_year))
             return False        
-    
-    # 将爬取结果保存到excel中
-    if len(result):
-        df = pd.DataFrame(data=result)
-        df.to_excel(output_file) 
+        rate_control.controller.record(time.time() - click_time, key=proxy)
+        turns += 1
+        turn_seconds += time.time() - click_time
+        if page_stats:
+            num_bytes = page_bytes(browser)
+            turn_bytes += num_bytes
+            telemetry.add('page_bytes', num_bytes)
+
+    crawled = max(1, page_cnt - first_page + 1)
+    print('Pages: {}, webdriver commands per page: {:.1f}, extraction commands per page: {:.1f}, extract mode: {}, latency per page turn: {:.2f}s{}, {}'.format(
+        crawled, (browser.command_count - commands_before) / crawled, extract_commands / crawled, extract_mode,
+        turn_seconds / max(1, turns), ', KB per page turn: {:.1f}'.format(turn_bytes / 1024 / max(1, turns)) if page_stats else '',
+        rate_control.status()))
+    return True
+
+# 检索结果的页数由结果总数确定，不再逐页点击下一页并等待刷新：沿用浏览器的会话(cookie与User-Agent)
+# 与页面上的检索语句，直接请求结果表格接口的第first_page页到最后一页(http_engine.page_workers大于1时并发请求)，按页码顺序写入output
+def fetch_pages(browser, journal, seg, total, first_page, output, stats):
+    try:
+        cookies = dict((cookie['name'], cookie['value']) for cookie in browser.get_cookies())
+        headers = {'User-Agent': browser.execute_script('return navigator.userAgent;')}
+        inputs = browser.find_elements_by_xpath('//input[@id="sqlVal"]')
+        search_sql = inputs[0].get_attribute('value') if inputs else ''
+    except WebDriverException as e:
+        print(str(e))
+        return False
+    num_pages = math.ceil(total / http_engine.PAGE_SIZE)
+    # 页面上没有检索语句时由接口重新检索第一页取得
+    if not search_sql and num_pages > 1:
+        html = http_engine.fetch_page(journal, seg[0], seg[1], 1, months=seg[2:], cookies=cookies, headers=headers)
+        if html is None:
+            return False
+        search_sql = http_engine.parse_search_sql(html)
+    if not http_engine.crawl_pages(journal, seg, total, first_page, output, search_sql, cookies, headers):
+        print('Failed to fetch pages. Journal: {}, year: {} - {}.'.format(journal, seg[0], seg[1]))
+        return False
+    stats['pages'] += max(0, num_pages - first_page + 1)
+    return True
+
+# 生成所有期刊在各年份范围内的爬取任务并登记到任务账本，已完成的任务跳过，返回任务列表与跳过的任务数
+def build_tasks(journals, output_dir, start_years, end_years, ledger):
+    tasks = []
+    for journal in journals:
+        for j in range(len(start_years)):
+            output_file = output_dir + '/' + journal + str(j + 1) + '.csv'
+            tasks.append((journal, start_years[j], end_years[j], output_file))
+    return ledger.schedule(tasks)
+
+# 解析命令行参数，argv为None时解析sys.argv
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(usage='python3 crawl.py [start end] [options]')
+    parser.add_argument('start', type=int, nargs='?', default=0, help='起始期刊下标(默认为第一个期刊)')
+    parser.add_argument('end', type=int, nargs='?', default=sys.maxsize, help='结束期刊下标(默认为最后一个期刊)')
+    parser.add_argument('--ledger', default='./tasks.db', help='任务账本(SQLite)路径')
+    parser.add_argument('--ledger-journal', choices=['WAL', 'DELETE'], default='WAL',
+                        help='任务账本的日志模式，账本放在NFS等网络文件系统上时需使用DELETE')
+    parser.add_argument('--lease', type=int, default=0,
+                        help='租约模式：从共享账本中认领任务，租期为该秒数，过期未续期的任务由其他工作进程(可在其他机器上)接管，0表示不使用')
+    parser.add_argument('--max-attempts', type=int, default=3, help='租约模式下每个任务的最大尝试次数')
+    parser.add_argument('--workers', type=int, default=1, help='并行爬取的工作进程数，每个进程使用自己的浏览器')
+    parser.add_argument('--recycle-pages', type=int, default=300, help='浏览器翻页数达到该值后回收，0表示不限制')
+    parser.add_argument('--recycle-rss', type=int, default=1024, help='浏览器内存占用(MB)达到该值后回收，0表示不限制')
+    parser.add_argument('--extract', choices=['script', 'html', 'element'], default='script',
+                        help='结果表格提取方式: script为一次execute_script，html为一次page_source并用lxml解析，element为逐个元素提取')
+    parser.add_argument('--engine', choices=['selenium', 'http', 'async'], default='selenium',
+                        help='爬取方式: selenium为浏览器，http为直接请求检索结果接口(不启动浏览器)，async为基于asyncio并发请求')
+    parser.add_argument('--concurrency', type=int, default=32, help='async方式下全局同时进行的请求数')
+    parser.add_argument('--per-host', type=int, default=8, help='async方式下每个主机同时进行的请求数')
+    parser.add_argument('--url', default=None, help='知网地址，可指向mock_server.py启动的本地替身服务器')
+    parser.add_argument('--record-dir', default=None, help='http方式下将请求到的每页结果保存到该目录，供mock_server.py离线回放')
+    parser.add_argument('--proxy', action='store_true', help='通过代理池中的代理访问知网')
+    parser.add_argument('--proxy-api', default='http://127.0.0.1:5010/', help='代理池接口地址')
+    parser.add_argument('--max-papers', type=int, default=planner.MAX_NUM_PAPERS, help='检索结果超过该数量时自动二分年份范围')
+    parser.add_argument('--counts-dir', default='./publish_numbers_parts',
+                        help='爬取文献的同时读取各年份发表数量并保存到该目录，为空字符串时不读取(仅selenium方式)')
+    parser.add_argument('--dedup', default='./dedup.db', help='文献指纹去重索引(SQLite)路径，写入前去掉之前已爬取过的文献，为空字符串时不去重')
+    parser.add_argument('--allow-duplicates-only', action='store_true',
+                        help='所有文献都是之前爬取过的重复文献的任务仍视为完成(保留只有表头的输出文件)，默认视为失败')
+    parser.add_argument('--merge-dir', default='./merged_output',
+                        help='任务完成后立即校验并将已完成的期刊合并到该目录，为空字符串时不进行后处理(async方式不支持)')
+    parser.add_argument('--min-delay', type=float, default=0.2, help='自适应翻页间隔的下限(秒)')
+    parser.add_argument('--max-delay', type=float, default=30, help='自适应翻页间隔的上限(秒)')
+    parser.add_argument('--lean', action='store_true',
+                        help='精简浏览器配置：无头模式、eager页面加载策略、屏蔽图片字体媒体与统计脚本，磁盘缓存保存在--browser-cache目录中')
+    parser.add_argument('--browser-cache', default='./browser_cache', help='精简模式下浏览器共用的磁盘缓存目录')
+    parser.add_argument('--page-fetch', choices=['click', 'http'], default='click',
+                        help='selenium方式的翻页方式：click为逐页点击下一页，http为检索后沿用浏览器的会话直接请求各页')
+    parser.add_argument('--page-workers', type=int, default=1,
+                        help='http方式与--page-fetch http时并发请求同一检索各页的线程数，结果按页码顺序写入')
+    parser.add_argument('--reuse-search', action='store_true',
+                        help='浏览器池中的浏览器在任务之间保留已打开的高级检索页面，只重新填写期刊名与年份并检索')
+    parser.add_argument('--page-stats', action='store_true', help='统计每次翻页传输的字节数(每页多执行一次WebDriver命令)')
+    parser.add_argument('--details', default=None,
+                        help='补充每篇文献的摘要、关键词、DOI与基金，以文献指纹为主键保存到该SQLite文件(async方式不支持)')
+    parser.add_argument('--detail-workers', type=int, default=4, help='并发请求文献详情页的线程数')
+    parser.add_argument('--output-dir', default='./output', help='输出目录，回放时可指定新的目录与账本，与之前的结果分开')
+    parser.add_argument('--response-cache', default=None,
+                        help='将请求到的检索结果页压缩后缓存到该SQLite文件，之后可用--replay回放')
+    parser.add_argument('--cache-ttl', type=float, default=7 * 24, help='响应缓存的有效期(小时)，0表示不过期')
+    parser.add_argument('--cache-size', type=int, default=2048, help='响应缓存的大小上限(MB)，超过时淘汰最久未用的页，0表示不限制')
+    parser.add_argument('--replay', action='store_true',
+                        help='只从响应缓存中读取结果页并重新提取(不启动浏览器，不产生网络请求)，用于修改解析规则后重新生成输出')
+    parser.add_argument('--spans', default=None, help='将各阶段(启动浏览器、检索、翻页等待、提取、写入等)的计时以json行追加到该文件')
+    parser.add_argument('--metrics-dir', default=None,
+                        help='定期将各阶段耗时的直方图以Prometheus文本格式写入该目录(供node_exporter的textfile collector采集)')
+    args = parser.parse_args(argv)
+    if args.replay and not args.response_cache:
+        parser.error('--replay requires --response-cache')
+    return args
 
-    browser.quit()
-    print('Finish crawling papers from {} published in year: {} - {}, number of papers: {}'.format(journal, start_year, end_year, len(result)))
-    return len(result) > 0
+# 根据命令行参数设置全局配置，同时作为工作进程的初始化函数
+def configure(args):
+    global extract_mode, url, use_proxy, proxy_api, MAX_NUM_PAPERS, counts_dir, lean, browser_cache_dir, page_stats, reuse_search, page_fetch
+    use_proxy, proxy_api = args.proxy, args.proxy_api
+    lean, browser_cache_dir, page_stats = args.lean, args.browser_cache, args.page_stats
+    reuse_search, page_fetch = args.reuse_search, args.page_fetch
+    http_engine.page_workers, http_engine.record_dir = args.page_workers, args.record_dir
+    counts_dir = args.counts_dir
+    # 回放时重新生成已爬取过的文献，不经过去重索引(否则所有文献都会被当作重复)
+    dedup.path, dedup.allow_duplicates_only = (None if args.replay else args.dedup), args.allow_duplicates_only
+    enrich.path, enrich.workers = args.details, args.detail_workers
+    response_cache.path, response_cache.replay = args.response_cache, args.replay
+    response_cache.ttl, response_cache.max_bytes = args.cache_ttl * 3600, args.cache_size * 1024 * 1024
+    MAX_NUM_PAPERS = http_engine.MAX_NUM_PAPERS = args.max_papers
+    extract_mode = args.extract
+    rate_control.controller = rate_control.RateController(min_delay=args.min_delay, max_delay=args.max_delay)
+    telemetry.configure(args.spans, args.metrics_dir)
+    if args.url:
+        url = http_engine.url = args.url
 
 def main():
-    if (len(sys.argv)) != 3:
-        print('Usage: python3 crawl_cnki.py start end')
-        return
-    else:
-        start, end = int(sys.argv[1]), int(sys.argv[2])
+    args = parse_args()
+    start, end = args.start, args.end
+    sys.stdout = Logger()
+    configure(args)
 
     start_time = time.time()
     print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
@@ -361,67 +916,56 @@ def main():
     journals = utils.read_txt(new_src, start, end)
 
     # 创建用于保存输出结果的目录
-    output_dir = './output'
+    output_dir = args.output_dir
     if not os.path.exists(output_dir):
-        os.mkdir(output_dir)
+        os.makedirs(output_dir)
     
     start_years = [2012, 2015, 2018]
     end_years = [2014, 2017, 2020]
     
-    cnt, total = 0, (end - start + 1) * len(start_years)
-    succeed = failed = skipped = 0
-    for i in range(end - start + 1):
-        for j in range(len(start_years)):
-            cnt += 1
-            output_file = output_dir + '/' + journals[i] + str(j + 1) + '.xlsx'
-            if not Path(output_file).is_file():
-                if start_crawl(journals[i], start_years[j], end_years[j], output_file):
-                    succeed += 1
-                else:
-                    failed += 1
-                print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}'.format(cnt, total, succeed, failed, skipped, time.time() - start_time))
-            else:
-                skipped += 1
-    '''
-    # 找出缺失的(未能爬下来的)文件，并把多出来的文件移动到其他目录
-    src = './output' + '_' + str(start) + '_' + str(end)
-    src = './output'
-    _, missing_files = utils.find_extra_missing(src, journals, './others')
-    cnt, total = 0, len(missing_files) * len(start_years)
-    succeed = failed = skipped = 0
-    '''
-    '''
-    # 按每三年一个文件爬取
-    for i in range(len(missing_files)):
-        cnt += 1
-        output_file = output_dir + '/' + journals[i]
-        journal, j = missing_files[i][:-6], int(missing_files[i][-6]) - 1
-        if not Path(output_file).is_file():
-            if start_crawl(journal, start_years[j], end_years[j], output_file):
-                succeed += 1
-            else:
-                failed += 1
-            print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}'.format(cnt, total, succeed, failed, skipped, time.time() - start_time))
-        else:
-            skipped += 1 
-    '''
-    '''
-    # 按每一年一个文件爬取
-    for i in range(len(missing_files)):
-        lst = missing_files[i].split('.')
-        journal, j = missing_files[i][:-6], int(missing_files[i][-6]) - 1
-        for year in range(start_years[j], end_years[j] + 1):
-            cnt += 1
-            output_file = output_dir + '/' + journal + str(year) + '.xlsx'
-            if not Path(output_file).is_file():
-                if start_crawl(journal, year, year, output_file):
-                    succeed += 1
-                else:
-                    failed += 1
-            else:
-                skipped += 1
-            print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}'.format(cnt, total, succeed, failed, skipped, time.time() - start_time))
-    '''
+    # 所有(期刊, 年份范围)任务放入同一任务队列，由多个工作进程并行爬取，每个进程使用自己的浏览器
+    # 任务状态记录在任务账本中，每个工作进程使用自己的账本连接
+    # 租约模式下各机器把自己范围内的任务登记到共享账本(已登记的任务不会重复登记)，再从账本中认领任意机器登记的任务
+    ledger = Ledger(args.ledger, journal_mode=args.ledger_journal)
+    tasks, skipped = build_tasks(journals, output_dir, start_years, end_years, ledger)
+    make_ledger = functools.partial(Ledger, args.ledger, 'papers', args.ledger_journal)
+    lease = scheduler.Lease(args.lease, args.max_attempts) if args.lease > 0 else None
+
+    # 任务完成后立即在后台校验文献数并合并已完成的期刊，校验不通过的任务立即重新爬取
+    # async方式不经过scheduler.run_tasks，不进行后处理(回放与租约模式下async改用http方式，仍进行后处理)
+    use_async = args.engine == 'async' and lease is None and not args.replay
+    post = None
+    if args.merge_dir and use_async:
+        print('Async engine does not validate or merge results, run utils.py after crawling.')
+    elif args.merge_dir:
+        journal_outputs = dict((journal, [output_dir + '/' + journal + str(j + 1) + '.csv' for j in range(len(start_years))])
+                               for journal in journals)
+        post = postprocess.PostProcessor(journal_outputs, args.merge_dir, counts_dir,
+                                         ledger_args=(args.ledger, 'papers', args.ledger_journal),
+                                         dedup=dedup.get_store()).expect(tasks).start()
+    if use_async:
+        import async_crawl  # 仅async方式需要aiohttp
+        succeed, failed = async_crawl.run_tasks(tasks, args.concurrency, args.per_host, skipped, start_time, ledger)
+    elif args.engine in ('http', 'async'):  # async方式不支持租约模式，租约模式下改用http方式
+        succeed, failed = scheduler.run_tasks(tasks, http_engine.start_crawl, args.workers, None, skipped, start_time,
+                                              init=functools.partial(configure, args), make_ledger=make_ledger,
+                                              status=rate_control.status, lease=lease, post=post)
+    else:
+        make_pool = functools.partial(new_pool, max_pages=args.recycle_pages, max_rss_mb=args.recycle_rss)
+        succeed, failed = scheduler.run_tasks(tasks, start_crawl, args.workers, make_pool, skipped, start_time,
+                                              init=functools.partial(configure, args), make_ledger=make_ledger,
+                                              status=rate_control.status, lease=lease, post=post)
+    if post is not None:
+        post.close()
+        print(post.summary())
+    # 将各任务的发表数量按期刊合并为check_publish_numbers所需的文件
+    if counts_dir and os.path.isdir(counts_dir):
+        utils.combine_year_counts(counts_dir, './publish_numbers')
+    print('Task ledger: {}'.format(ledger.summary()))
+    ledger.close()
+    # 多进程时各阶段的计时由各工作进程分别输出
+    if telemetry.summary() is not None:
+        print(telemetry.summary())
     print('Finished crawl. Total succeed: {}, total failed: {}, total skipped: {}, total used time: {}'.format(succeed, failed, skipped, time.time() - start_time))                
     
 if __name__ == '__main__':
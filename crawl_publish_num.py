@@ -1,34 +1,23 @@
 #!/usr/bin/env python3
 from selenium import webdriver
-from selenium.webdriver import ActionChains
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import TimeoutException
-from selenium.common.exceptions import NoSuchElementException
 import pandas as pd
 import time
-import random
-from collections import OrderedDict
 import sys
 import os
-from pathlib import Path
-from multiprocessing import Pool
+import argparse
+import functools
+import scheduler
+import telemetry
 import utils
+import crawl
+from browser_pool import BrowserPool
+from ledger import Ledger
+from crawl import open_search, reset_browser, timed_search, read_year_counts, cache_slot, lean_options, lean_browser
 
-# 用于记录屏幕输出
-class Logger(object):
+# 用于记录屏幕输出，日志文件由后台线程写入
+class Logger(telemetry.Logger):
     def __init__(self, filename="crawl_publish_num.log"):
-        self.terminal = sys.stdout
-        self.log = open(filename, "a")
- 
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
- 
-    def flush(self):
-        pass
-sys.stdout = Logger()
+        super(Logger, self).__init__(filename)
 
 # 将每三位以逗号分隔的字符串表示的数字转换成阿拉伯数字
 def str2int(s):
@@ -48,227 +37,137 @@ def check_date(y, start, end):
 url = 'https://chn.oversea.cnki.net/'
 WAIT_SECONDS = 15
 MAX_NUM_PAPERS = 1500
+lean = False  # 精简浏览器配置，见crawl.lean
+browser_cache_dir = './browser_cache'
 
 type_browser = 'chrome'  # 浏览器类型(目前仅支持chrome和firefox)
 # 浏览器驱动路径
 path_firefox_driver = '/home/panda/Downloads/geckodriver'
 path_chrome_driver = '/home/panda/Downloads/chromedriver'
 
-def get_browser(type_browser, headless=False):
-    global path_firefox_driver, path_chrome_driver
+def get_browser(type_browser, headless=False, lean=False):
+    global path_firefox_driver, path_chrome_driver, browser_cache_dir
     browser = None
+    cache, lock = cache_slot(browser_cache_dir) if lean else (None, None)
 
     if type_browser == 'firefox':
         from selenium.webdriver.firefox.options import Options
         options = Options()
         if headless:
             options.add_argument('--headless')  
+        if lean:
+            lean_options(options, type_browser, cache)
         browser = webdriver.Firefox(options=options, executable_path=path_firefox_driver) 
     elif type_browser == 'chrome':
         from selenium.webdriver.chrome.options import Options
         options = Options()
         if headless:
             options.add_argument('--headless')
+        if lean:
+            lean_options(options, type_browser, cache)
         options.add_argument('--no-sandbox')
         options.add_argument('start-maximized')
         options.add_argument('--disable-infobars')
         options.add_argument('--disable-extentions')
         browser = webdriver.Chrome(options=options, executable_path=path_chrome_driver)
         
+    if browser is not None and lean:
+        lean_browser(browser, lock)
     return browser
 
-def start_crawl(journal, start_year, end_year, output_file):
-    global type_browser, url, WAIT_SECONDS, MAX_NUM_PAPERS
-    print('Start crawling publish number of journal {} during {} - {}'.format(journal, start_year, end_year))
-
-    browser = get_browser(type_browser, headless=False)
-    browser.get(url)
-
-    # 等待高级检索按键加载完成并点击
-    try:
-        a_high_search = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.element_to_be_clickable(
-                (By.LINK_TEXT, '高级检索')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for loading of high search buttom.')
-        browser.quit()
-        return False
-    a_high_search.click()
-    time.sleep(1)
-
-    # 切换到最新打开的窗口
-    windows = browser.window_handles
-    browser.switch_to.window(windows[-1])
-
-    # 找到文献来源标签，用于后面判断点击刷新完成
+# 启动浏览器并打开高级检索页面，失败返回None
+def new_browser():
+    global type_browser, lean
+    with telemetry.span('browser_launch', lean=lean):
+        browser = get_browser(type_browser, headless=lean, lean=lean)
+    if browser is None:
+        return None
     try:
-        span_src = browser.find_element_by_xpath('//*[@id="gradetxt"]/dd[3]/div[2]/div[1]/div[1]/span')
-    except NoSuchElementException as e:
+        ready = open_search(browser)
+    except Exception as e:
         print(str(e))
-        browser.quit()
-        return False
-
-    # 等待学术期刊按键加载完成并点击
-    try:
-        span_journal = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.element_to_be_clickable(
-                (By.XPATH, '//ul[@class="doctype-menus keji"]/li[@data-id="xsqk"]/a/span')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for loading of journal buttom.')
-        browser.quit()
-        return False
-    browser.execute_script('arguments[0].click();', span_journal)
-
-    # 通过文献来源标签的过期判断刷新完成
-    try:
-        WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.staleness_of(span_src)
-        )
-    except TimeoutException as e:
-        print('Timeout during refresh after clicking journal buttom')
-        browser.quit()
-        return False
-
-    # 等待期刊名称输入框加载完成
-    try:
-        input_journal = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.presence_of_element_located(
-                (By.XPATH, '//*[@id="gradetxt"]/dd[3]/div[2]/input')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for input box for jounral name.')
-        browser.quit()
-        return False
-    input_journal.send_keys(journal)  # 输入期刊名
-    time.sleep(1)
+        ready = False
+    if not ready:
+        try:
+            browser.quit()
+        except Exception as e:
+            print(str(e))
+        return None
+    return browser
 
-    # 找到起始年输入框并输入起始年
-    try:
-        input_start_year = browser.find_element_by_xpath('//input[@placeholder="起始年"]')
-    except NoSuchElementException as e:
-        print(str(e))
-        browser.quit()
-        return False
-    input_start_year.send_keys(start_year)
+# 创建浏览器池：工作进程串行执行任务，每个进程保持一个已打开高级检索页面的浏览器，需要多个浏览器时增加--workers
+def new_pool(max_pages=0, max_rss_mb=0):
+    return BrowserPool(new_browser, reset_browser, max_pages=max_pages, max_rss_mb=max_rss_mb)
 
-    # 找到结束输入框并输入结束年
-    try:
-        input_end_year = browser.find_element_by_xpath('//input[@placeholder="结束年"]')
-    except NoSuchElementException as e:
-        print(str(e))
-        browser.quit()
-        return False
-    input_end_year.send_keys(end_year)
+# 爬取期刊journal在start_year到end_year间每年的发表数量，保存到output_file中
+# 传入浏览器池pool时从池中取用已打开高级检索页面的浏览器，否则为本任务单独启动浏览器
+def start_crawl(journal, start_year, end_year, output_file, pool=None):
+    print('Start crawling publish number of journal {} during {} - {}'.format(journal, start_year, end_year))
 
-    # 找到检索键并点击
-    try:
-        input_search = browser.find_element_by_xpath('//input[@value="检索"]')
-    except NoSuchElementException as e:
-        print(str(e))
-        browser.quit()
+    browser = pool.acquire() if pool is not None else new_browser()
+    if browser is None:
+        print('Failed to start browser. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
         return False
-    input_search.click()
 
-    # 根据搜索结果总数标签的出现判断页面是否刷新完成
+    ok = False
     try:
-        em_total = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.visibility_of_element_located(
-                (By.XPATH, '//*[@id="countPageDiv"]/span[1]/em')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for paper number cell.')
-        browser.quit()
-        return False
-    expected_num = str2int(em_total.text)
+        ok = crawl_publish_num(browser, journal, start_year, end_year, output_file)
+    finally:
+        if pool is not None:
+            pool.release(browser, pages=1, discard=not ok)
+        else:
+            browser.quit()
+    return ok
 
-    # 找到发表年度
-    try:
-        dt_year = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.element_to_be_clickable(
-                (By.XPATH, '//dt[@groupitem="发表年度"]')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for loading of publish years list. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
-        browser.quit()
+# 在已打开高级检索页面的浏览器中检索并保存每年的发表数量
+def crawl_publish_num(browser, journal, start_year, end_year, output_file):
+    expected_num = timed_search(browser, journal, start_year, end_year)
+    if expected_num is None:
         return False
-    
-    # 将鼠标移动到发表年度，若发表年度被折叠，则点击之
-    action = ActionChains(browser).move_to_element(dt_year)
-    dt_year_parent = browser.find_element_by_xpath('//dt[@groupitem="发表年度"]/..')
-    if dt_year_parent.get_attribute('class') == 'is-up-fold off':
-        action.click().perform()  # 点击发表年度
-
-    # 让鼠标悬浮在发表年度的部分展开列表上，使其完全展开
-    try:
-        div_lst = WebDriverWait(browser, WAIT_SECONDS).until(
-            EC.visibility_of_element_located(
-                (By.XPATH, '//dd[@tit="发表年度"]/div')
-            )
-        )
-    except TimeoutException as e:
-        print('Timeout during waiting for display of complete publish years. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
-        browser.quit()
+    with telemetry.span('year_counts', journal=journal, years='{}-{}'.format(start_year, end_year)):
+        info = read_year_counts(browser, journal, start_year, end_year, expected_num)
+    if info is None:
         return False
-    ActionChains(browser).move_to_element(div_lst).perform()      
-
-    info = OrderedDict()
-    info['期刊名称'] = journal
-    actual_num = 0
-    timeout = False
-    # 找到目标范围内的年份的发表数量
-    for year in range(start_year, end_year + 1):
-        if not timeout or year == 2014:
-            try:
-                span = WebDriverWait(browser, WAIT_SECONDS).until(
-                    EC.visibility_of_element_located(
-                        (By.XPATH, '//input[@type="checkbox" and @text="{0}" and @value="{0}"]/following-sibling::span'.format(str(year)))
-                    )
-                )
-            except TimeoutException as e:
-                print('No paper found for journal {0} in year {1}. Journal: {0}, year: {2} - {3}.'.format(journal, year, start_year, end_year))
-                info[str(year)] = 0
-                timeout = True
-                continue
-        else:
-            try:
-                span = browser.find_element_by_xpath('//input[@type="checkbox" and @text="{0}" and @value="{0}"]/following-sibling::span'.format(str(year)))
-            except NoSuchElementException as e:
-                print(str(e))
-                info[str(year)] = 0
-                continue
-        #print('year: {}, num: {}'.format(year, span.text))
-        num = int(span.text[1:-1])
-        info[str(year)] = num   
-        actual_num += num
 
-    # 检验九年发表数量总和是否等于筛选结果数量
-    if actual_num != expected_num:
-        print('Total number of papers conflict, expected number: {}, actual number: {}. Journal: {}, year: {} - {}.'.format(expected_num, actual_num, journal, start_year, end_year))
-        browser.quit()
-        return False
-    
-    info['总数'] = expected_num
     # 将爬取结果保存到excel中
     df = pd.DataFrame(data=[info])
     df.to_excel(output_file) 
     
-    browser.quit()
     print('Finish crawling publish number of journal {} during {} - {}, expected number of papers: {}'.format(journal, start_year, end_year, expected_num))
     return True
 
+# 解析命令行参数
+def parse_args():
+    parser = argparse.ArgumentParser(usage='python3 crawl_publish_num.py [start end] [options]')
+    parser.add_argument('start', type=int, nargs='?', default=0, help='起始期刊下标(默认为第一个期刊)')
+    parser.add_argument('end', type=int, nargs='?', default=sys.maxsize, help='结束期刊下标(默认为最后一个期刊)')
+    parser.add_argument('--ledger', default='./tasks.db', help='任务账本(SQLite)路径')
+    parser.add_argument('--ledger-journal', choices=['WAL', 'DELETE'], default='WAL',
+                        help='任务账本的日志模式，账本放在NFS等网络文件系统上时需使用DELETE')
+    parser.add_argument('--lease', type=int, default=0,
+                        help='租约模式：从共享账本中认领任务，租期为该秒数，过期未续期的任务由其他工作进程(可在其他机器上)接管，0表示不使用')
+    parser.add_argument('--max-attempts', type=int, default=3, help='租约模式下每个任务的最大尝试次数')
+    parser.add_argument('--workers', type=int, default=1, help='并行爬取的工作进程数，每个进程使用自己的浏览器')
+    parser.add_argument('--recycle-pages', type=int, default=300, help='浏览器翻页数达到该值后回收，0表示不限制')
+    parser.add_argument('--recycle-rss', type=int, default=1024, help='浏览器内存占用(MB)达到该值后回收，0表示不限制')
+    parser.add_argument('--lean', action='store_true',
+                        help='精简浏览器配置：无头模式、eager页面加载策略、屏蔽图片字体媒体与统计脚本，磁盘缓存保存在--browser-cache目录中')
+    parser.add_argument('--browser-cache', default='./browser_cache', help='精简模式下浏览器共用的磁盘缓存目录')
+    parser.add_argument('--reuse-search', action='store_true',
+                        help='浏览器池中的浏览器在任务之间保留已打开的高级检索页面，只重新填写期刊名与年份并检索')
+    return parser.parse_args()
+
+# 根据命令行参数设置全局配置，同时作为工作进程的初始化函数
+def configure(args):
+    global lean, browser_cache_dir
+    lean, browser_cache_dir = args.lean, args.browser_cache
+    crawl.reuse_search = args.reuse_search
+
 def main():
-    if (len(sys.argv)) != 3:
-        print('Usage: python3 crawl_cnki.py start end')
-        return
-    else:
-        start, end = int(sys.argv[1]), int(sys.argv[2])
+    args = parse_args()
+    start, end = args.start, args.end
+    sys.stdout = Logger()
+    configure(args)
 
     start_time = time.time()
     print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
@@ -284,20 +183,19 @@ def main():
         os.mkdir(output_dir)
     
     start_year, end_year = 2012, 2020
-    cnt, total = 0, end - start + 1
-    succeed = failed = skipped = 0
-    
-    for i in range(end - start + 1):
-        cnt += 1
-        output_file = output_dir + '/' + journals[i] + '.xlsx'
-        if not Path(output_file).is_file():
-            if start_crawl(journals[i], start_year, end_year, output_file):
-                succeed += 1
-            else:
-                failed += 1
-            print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}'.format(cnt, total, succeed, failed, skipped, time.time() - start_time))
-        else:
-            skipped += 1
+    # 任务状态记录在任务账本中，与文献信息任务共用账本，以任务类型区分
+    ledger = Ledger(args.ledger, kind='publish_num', journal_mode=args.ledger_journal)
+    tasks, skipped = ledger.schedule([(journal, start_year, end_year, output_dir + '/' + journal + '.xlsx') for journal in journals])
+    make_ledger = functools.partial(Ledger, args.ledger, 'publish_num', args.ledger_journal)
+    lease = scheduler.Lease(args.lease, args.max_attempts) if args.lease > 0 else None
+
+    make_pool = functools.partial(new_pool, max_pages=args.recycle_pages, max_rss_mb=args.recycle_rss)
+    succeed, failed = scheduler.run_tasks(tasks, start_crawl, args.workers, make_pool, skipped, start_time,
+                                          init=functools.partial(configure, args), make_ledger=make_ledger, lease=lease)
+    print('Task ledger: {}'.format(ledger.summary()))
+    ledger.close()
+    if telemetry.summary() is not None:
+        print(telemetry.summary())
             
     print('Finished crawl. Total succeed: {}, total failed: {}, total skipped: {}, total used time: {}'.format(succeed, failed, skipped, time.time() - start_time))                
     
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import collections
+import unicodedata
+import page_parser
+
+# 文献指纹：篇名、作者、期刊名称与发表日期规范化后的SHA-1摘要
+# 规范化去掉全角半角、大小写、空白与标点的差异，作者按姓名排序，发表时间只取日期部分
+fingerprint_cols = ['篇名', '作者', '期刊名称', '发表时间']
+
+def normalize(text):
+    text = unicodedata.normalize('NFKC', str(text or '')).lower()
+    return ''.join(ch for ch in text if ch.isalnum())
+
+def fingerprint(row, columns=page_parser.columns):
+    values = dict(zip(columns, row))
+    authors = sorted(normalize(author) for author in re.split(r'[;；,，、\s]+', str(values.get('作者') or '')) if normalize(author))
+    date = re.sub(r'\D', '', str(values.get('发表时间') or ''))[:8]
+    key = '\x1f'.join([normalize(values.get('篇名')), ';'.join(authors), normalize(values.get('期刊名称')), date])
+    return hashlib.sha1(key.encode('utf-8')).digest()
+
+# 持久化的去重索引：以指纹为主键的SQLite表(WAL模式，多个工作进程可共用)，记录每个指纹来自哪个任务(期刊, 年份范围)的第几页
+# 写入输出文件前过滤掉已经出现过的文献，合并时不必再对全部文献去重；指纹按任务而不是输出文件路径登记，
+# 同一任务换一个输出目录重新爬取时不会把自己之前的文献当作重复
+# 每个任务每页去掉的重复文献按发表年份记录在dropped表中，校验文献数时与输出文件中的文献数相加
+# 任务从头重新爬取或从检查点继续时，先用truncate删除该任务在检查点之后登记的指纹与重复文献数，避免把自己的文献当作重复
+# allow_duplicates_only为False时，所有文献都是重复文献(输出文件只有表头)的任务视为失败
+class DedupStore(object):
+    def __init__(self, path='./dedup.db', allow_duplicates_only=False):
+        self.path = path
+        self.allow_duplicates_only = allow_duplicates_only
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        # 旧版本按输出文件路径登记指纹，无法对应到任务，重新建表
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(fingerprints)')]
+        if columns and 'journal' not in columns:
+            print('Dedup index {} was keyed by output file, rebuilding it.'.format(path))
+            self.conn.execute('DROP TABLE fingerprints')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS fingerprints (
+            fp BLOB PRIMARY KEY,
+            journal TEXT NOT NULL,
+            start_year INTEGER NOT NULL,
+            end_year INTEGER NOT NULL,
+            page INTEGER NOT NULL,
+            added_at REAL) WITHOUT ROWID''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS fingerprints_task ON fingerprints (journal, start_year, end_year, page)')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS dropped (
+            journal TEXT NOT NULL,
+            start_year INTEGER NOT NULL,
+            end_year INTEGER NOT NULL,
+            page INTEGER NOT NULL,
+            year TEXT NOT NULL,
+            num INTEGER NOT NULL,
+            PRIMARY KEY (journal, start_year, end_year, page, year)) WITHOUT ROWID''')
+        self.dropped = 0
+
+    # 登记任务task(期刊, 起始年, 结束年)第page页文献的指纹，返回其中未出现过的文献(同一任务内重复的文献只保留第一篇)
+    def filter(self, rows, task, page, columns=page_parser.columns):
+        now = time.time()
+        new_rows = []
+        years = collections.Counter()
+        year_index = columns.index('发表时间') if '发表时间' in columns else None
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for row in rows:
+                    cursor = self.conn.execute('INSERT OR IGNORE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)',
+                                               (fingerprint(row, columns),) + tuple(task) + (page, now))
+                    if cursor.rowcount:
+                        new_rows.append(row)
+                    else:
+                        years[str(row[year_index] or '')[:4] if year_index is not None else ''] += 1
+                for year, num in years.items():
+                    self.conn.execute('INSERT OR REPLACE INTO dropped VALUES (?, ?, ?, ?, ?, ?)', tuple(task) + (page, year, num))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.dropped += len(rows) - len(new_rows)
+        return new_rows
+
+    # 删除任务task在第page页之后登记的指纹与重复文献数
+    def truncate(self, task, page=0):
+        with self.lock:
+            for table in ('fingerprints', 'dropped'):
+                self.conn.execute('DELETE FROM {} WHERE journal = ? AND start_year = ? AND end_year = ? AND page > ?'.format(table),
+                                  tuple(task) + (page,))
+
+    # 任务task去掉的重复文献数，返回发表年份 -> 文献数
+    def dropped_counts(self, task):
+        with self.lock:
+            rows = self.conn.execute('''SELECT year, SUM(num) FROM dropped WHERE journal = ? AND start_year = ? AND end_year = ?
+                                        GROUP BY year''', tuple(task)).fetchall()
+        return collections.Counter(dict(rows))
+
+    def close(self):
+        self.conn.close()
+
+path = None  # 去重索引路径，为None时不去重
+allow_duplicates_only = False
+store = None
+
+# 每个进程共用一个去重索引，首次使用时打开，未设置path时返回None
+def get_store():
+    global store
+    if store is None and path:
+        store = DedupStore(path, allow_duplicates_only)
+    return store
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import csv
+import time
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import page_parser
+import dedup
+import http_engine
+import rate_control
+import telemetry
+
+# 请求文献详情页，返回按page_parser.detail_cols顺序排列的摘要、关键词、DOI与基金，失败返回None
+# 与翻页共用本进程的速率控制器，详情请求同样受翻页间隔限制并参与间隔的调整
+def fetch_detail(link):
+    with telemetry.span('rate_wait'):
+        rate_control.controller.wait()
+    request_time = time.time()
+    try:
+        with telemetry.span('detail_fetch'):
+            response = http_engine.get_session().get(urljoin(http_engine.url, link), timeout=http_engine.WAIT_SECONDS)
+            response.raise_for_status()
+    except requests.RequestException as e:
+        rate_control.controller.record(ok=False)
+        print('{}. Detail page: {}.'.format(str(e), link))
+        return None
+    rate_control.controller.record(time.time() - request_time)
+    response.encoding = 'utf-8'
+    return page_parser.parse_detail(response.text)
+
+# 文献详情补充：爬取结果表格时登记每篇文献的详情链接，由线程池(每个线程复用自己的Session)并发请求详情页，
+# 结果以文献指纹(dedup.fingerprint)为主键保存在SQLite表中(WAL模式，多个工作进程可共用)，已补充过的文献不再请求
+# 在途请求数超过workers的4倍时submit阻塞，使爬取不会远远领先于详情补充；失败的文献保留为pending，最多尝试max_attempts次
+class Enricher(object):
+    def __init__(self, path='./details.db', workers=4, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS details (
+            fp BLOB PRIMARY KEY,
+            link TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            abstract TEXT,
+            keywords TEXT,
+            doi TEXT,
+            fund TEXT,
+            fetched_at REAL) WITHOUT ROWID''')
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(workers * 4)
+        self.cond = threading.Condition()
+        self.inflight = set()  # 已提交尚未完成的文献指纹
+        self.fetched = self.failed = self.skipped = 0
+
+    # 登记一页文献的详情链接(与rows一一对应)，把未补充过且不在途的文献提交给线程池
+    def submit(self, rows, links, columns=page_parser.columns):
+        todo = []
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for row, link in zip(rows, links):
+                    if not link:
+                        continue
+                    fp = dedup.fingerprint(row, columns)
+                    self.conn.execute('INSERT OR IGNORE INTO details (fp, link) VALUES (?, ?)', (fp, link))
+                    status, attempts = self.conn.execute('SELECT status, attempts FROM details WHERE fp = ?', (fp,)).fetchone()
+                    if status == 'pending' and attempts < self.max_attempts:
+                        todo.append((fp, link))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        with self.cond:
+            todo = [(fp, link) for fp, link in todo if fp not in self.inflight]
+            self.inflight.update(fp for fp, link in todo)
+            self.skipped += len(rows) - len(todo)
+        for fp, link in todo:
+            self.slots.acquire()
+            self.executor.submit(self.enrich, fp, link)
+
+    def enrich(self, fp, link):
+        try:
+            detail = fetch_detail(link)
+            with self.lock:
+                if detail is None:
+                    self.conn.execute('''UPDATE details SET attempts = attempts + 1,
+                        status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END WHERE fp = ?''', (self.max_attempts, fp))
+                    self.failed += 1
+                else:
+                    self.conn.execute('''UPDATE details SET status = 'done', attempts = attempts + 1, abstract = ?, keywords = ?,
+                        doi = ?, fund = ?, fetched_at = ? WHERE fp = ?''', tuple(detail) + (time.time(), fp))
+                    self.fetched += 1
+        except Exception as e:
+            print('Enrichment error: {}. Detail page: {}.'.format(str(e), link))
+        finally:
+            self.slots.release()
+            with self.cond:
+                self.inflight.discard(fp)
+                self.cond.notify_all()
+
+    # 之前的运行中未完成的文献，返回(指纹, 链接)列表
+    def pending(self):
+        with self.lock:
+            return self.conn.execute("SELECT fp, link FROM details WHERE status = 'pending' AND attempts < ?",
+                                     (self.max_attempts,)).fetchall()
+
+    # 重新提交之前未完成的文献
+    def resume(self):
+        items = self.pending()
+        with self.cond:
+            items = [(fp, link) for fp, link in items if fp not in self.inflight]
+            self.inflight.update(fp for fp, link in items)
+        for fp, link in items:
+            self.slots.acquire()
+            self.executor.submit(self.enrich, fp, link)
+        return len(items)
+
+    # 等待所有在途请求完成
+    def wait(self):
+        with self.cond:
+            while self.inflight:
+                self.cond.wait()
+
+    # 将已补充的详情导出为csv文件，第一列为十六进制的文献指纹
+    def export(self, out_path):
+        with self.lock:
+            rows = self.conn.execute("SELECT hex(fp), abstract, keywords, doi, fund FROM details WHERE status = 'done'").fetchall()
+        with open(out_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['指纹'] + page_parser.detail_cols)
+            writer.writerows(rows)
+        return len(rows)
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        self.conn.close()
+
+    def summary(self):
+        return 'Enrichment: fetched: {}, failed: {}, skipped: {}'.format(self.fetched, self.failed, self.skipped)
+
+path = None  # 详情表路径，为None时不补充详情
+workers = 4
+enricher = None
+
+# 每个进程共用一个详情补充器，首次使用时创建，未设置path时返回None
+def get_enricher():
+    global enricher
+    if enricher is None and path:
+        enricher = Enricher(path, workers)
+    return enricher
+
+# 单独运行时重新请求之前未完成的文献详情，并可导出已补充的详情
+def main():
+    parser = argparse.ArgumentParser(usage='python3 enrich.py [--details PATH] [--workers N] [--export CSV]')
+    parser.add_argument('--details', default='./details.db', help='文献详情表(SQLite)路径')
+    parser.add_argument('--workers', type=int, default=4, help='并发请求详情页的线程数')
+    parser.add_argument('--url', default=None, help='知网地址(可指向mock_server)')
+    parser.add_argument('--export', default=None, help='将已补充的详情导出为该csv文件')
+    args = parser.parse_args()
+    if args.url:
+        http_engine.url = args.url
+    details = Enricher(args.details, args.workers)
+    print('Resume {} pending papers.'.format(details.resume()))
+    details.wait()
+    print(details.summary())
+    if args.export:
+        print('Exported {} papers to {}.'.format(details.export(args.export), args.export))
+    details.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import os
+import json
+import math
+import calendar
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+import lxml.html
+import page_parser
+import sink
+import dedup
+import rate_control
+import planner
+import telemetry
+import enrich
+import response_cache
+
+# 不启动浏览器，直接请求高级检索的结果表格接口并解析返回的html，与crawl.start_crawl使用相同的调用方式
+url = 'https://chn.oversea.cnki.net/'
+grid_path = 'kns/Brief/GetGridTableHtml'  # 检索结果表格接口
+WAIT_SECONDS = 15
+PAGE_SIZE = 50
+MAX_NUM_PAPERS = planner.MAX_NUM_PAPERS
+page_workers = 1  # 并发请求结果页的线程数，大于1时同一检索的各页并发请求，按页码顺序写入
+record_dir = None  # 不为None时将请求到的每页结果保存到该目录，供mock_server离线回放
+
+headers = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.93 Safari/537.36',
+    'X-Requested-With': 'XMLHttpRequest',
+}
+
+local = threading.local()
+executor = None
+
+# 每个线程复用一个带连接池的Session，保持长连接
+def get_session():
+    session = getattr(local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(headers)
+        session.headers['Referer'] = url + 'kns/AdvSearch?dbcode=CJFQ'
+        local.session = session
+    return session
+
+# 每个进程共用一个请求结果页的线程池，首次使用时创建，每个线程复用自己的Session
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(page_workers)
+    return executor
+
+# 构造检索条件：文献来源为journal，发表年度为start_year到end_year的学术期刊
+# months为(起始月, 结束月)时进一步限定发表时间，用于单一年份的检索结果过多时按月细分
+def build_query(journal, start_year, end_year, months=None):
+    source = {'Key': 'input[data-tipid=gradetxt-3]', 'Title': '文献来源', 'Logic': 0, 'Name': 'LY', 'Operate': '%',
+              'Value': journal, 'ExtendType': 1, 'ExtendValue': '中英文对照', 'Value2': '', 'BlurType': ''}
+    years = {'Key': '.tit-dropdown-box>.sort', 'Title': '发表年度', 'Logic': 1, 'Name': 'YE', 'Operate': '',
+             'Value': str(start_year), 'ExtendType': 0, 'ExtendValue': '', 'Value2': str(end_year), 'BlurType': ''}
+    controls = [years]
+    if months is not None and tuple(months) != (1, 12):
+        last_day = calendar.monthrange(end_year, months[1])[1]
+        controls.append({'Key': '.tit-dropdown-box>.sort', 'Title': '发表时间', 'Logic': 1, 'Name': 'PT', 'Operate': '7',
+                         'Value': '{}-{:02d}-01'.format(start_year, months[0]), 'ExtendType': 0, 'ExtendValue': '',
+                         'Value2': '{}-{:02d}-{:02d}'.format(end_year, months[1], last_day), 'BlurType': ''})
+    query = {
+        'Platform': '', 'DBCode': 'CJFQ', 'KuaKuCode': '',
+        'QNode': {'QGroup': [
+            {'Key': 'Subject', 'Title': '', 'Logic': 1, 'Items': [],
+             'ChildItems': [{'Key': source['Key'], 'Title': '', 'Logic': 0, 'Items': [source], 'ChildItems': []}]},
+            {'Key': 'ControlGroup', 'Title': '', 'Logic': 1, 'Items': [],
+             'ChildItems': [{'Key': years['Key'], 'Title': '', 'Logic': 1, 'Items': controls, 'ChildItems': []}]},
+        ]},
+    }
+    return json.dumps(query, ensure_ascii=False)
+
+# 从检索条件中解析出期刊名、起始年、结束年与月份范围(未限定时为None)，build_query的逆过程
+def parse_query(query_json):
+    journal = start_year = end_year = months = None
+    for group in json.loads(query_json)['QNode']['QGroup']:
+        for child in group['ChildItems']:
+            for item in child['Items']:
+                if item['Name'] == 'LY':
+                    journal = item['Value']
+                elif item['Name'] == 'YE':
+                    start_year, end_year = int(item['Value']), int(item['Value2'])
+                elif item['Name'] == 'PT':
+                    months = (int(item['Value'].split('-')[1]), int(item['Value2'].split('-')[1]))
+    return journal, start_year, end_year, months
+
+# 请求的表单数据，第一页为新检索，之后的页使用第一页返回的检索语句翻页
+def build_form(journal, start_year, end_year, page, search_sql='', months=None):
+    return {
+        'IsSearch': 'true' if page == 1 else 'false',
+        'QueryJson': build_query(journal, start_year, end_year, months),
+        'SearchSql': search_sql,
+        'PageName': 'AdvSearch',
+        'DBCode': 'CJFQ',
+        'KuaKuCodes': '',
+        'CurPage': str(page),
+        'RecordsCntPerPage': str(PAGE_SIZE),
+        'CurDisplayMode': 'listmode',
+        'CurrSortField': '',
+        'CurrSortFieldType': 'desc',
+        'IsSentenceSearch': 'false',
+        'Subject': '',
+    }
+
+# 保存的每页结果的文件名
+def fixture_name(journal, start_year, end_year, page, months=None):
+    if months is not None and tuple(months) != (1, 12):
+        return '{}_{}_{}_{}-{}_{}.html'.format(journal, start_year, end_year, months[0], months[1], page)
+    return '{}_{}_{}_{}.html'.format(journal, start_year, end_year, page)
+
+# 取得一页检索结果，返回html，失败返回None
+# 设置了响应缓存时先从缓存读取，请求到的结果页存入缓存；回放模式下只从缓存读取，不产生网络请求
+def fetch_page(journal, start_year, end_year, page, search_sql='', months=None, cookies=None, headers=None):
+    global PAGE_SIZE
+    cache = response_cache.get_cache()
+    if cache is None:
+        return request_page(journal, start_year, end_year, page, search_sql, months, cookies, headers)
+    key, request = cache.make_key(journal, start_year, end_year, page, PAGE_SIZE, months)
+    html = cache.get(key)
+    if html is not None:
+        telemetry.add('cache_hits')
+        return html
+    if cache.replay:
+        print('Page not in response cache. Journal: {}, year: {} - {}, page: {}.'.format(journal, start_year, end_year, page))
+        return None
+    html = request_page(journal, start_year, end_year, page, search_sql, months, cookies, headers)
+    # 验证码等不含检索结果的页不缓存
+    if html is not None and 'countPageDiv' in html:
+        cache.put(key, request, html)
+    return html
+
+# 请求一页检索结果，返回html，失败返回None
+# cookies与headers附加到本次请求，用于沿用浏览器的会话
+def request_page(journal, start_year, end_year, page, search_sql='', months=None, cookies=None, headers=None):
+    global url, grid_path, WAIT_SECONDS, record_dir
+    # 由速率控制器决定请求间隔，并根据响应时间与失败情况调整
+    with telemetry.span('rate_wait'):
+        rate_control.controller.wait()
+    request_time = time.time()
+    try:
+        with telemetry.span('fetch', journal=journal, page=page) as attrs:
+            response = get_session().post(url + grid_path, data=build_form(journal, start_year, end_year, page, search_sql, months),
+                                          cookies=cookies, headers=headers, timeout=WAIT_SECONDS)
+            response.raise_for_status()
+            attrs['bytes'] = len(response.content)
+            telemetry.add('page_bytes', attrs['bytes'])
+    except requests.RequestException as e:
+        rate_control.controller.record(ok=False)
+        print('{}. Journal: {}, year: {} - {}, page: {}.'.format(str(e), journal, start_year, end_year, page))
+        return None
+    rate_control.controller.record(time.time() - request_time)
+    response.encoding = 'utf-8'
+    html = response.text
+    if record_dir is not None:
+        os.makedirs(record_dir, exist_ok=True)
+        with open(os.path.join(record_dir, fixture_name(journal, start_year, end_year, page, months)), 'w', encoding='utf-8') as f:
+            f.write(html)
+    return html
+
+# 从第一页结果中取出翻页所需的检索语句
+def parse_search_sql(html):
+    values = lxml.html.fromstring(html).xpath('//input[@id="sqlVal"]/@value')
+    return values[0] if values else ''
+
+# 解析一页结果并写入output，需要补充详情时同时登记各文献的详情链接
+def write_page(output, html, journal, page):
+    with telemetry.span('extract', journal=journal, page=page):
+        rows = page_parser.parse_grid(html)
+    details = enrich.get_enricher()
+    if details is not None:
+        details.submit(rows, page_parser.parse_links(html))
+    with telemetry.span('write', journal=journal, page=page):
+        output.write(rows)
+
+# 用检索语句search_sql请求子范围seg(共total篇)的第first_page页到最后一页，按页码顺序写入output
+# 页数由结果总数确定，page_workers大于1时各页在线程池中并发请求，某页失败时取消之后尚未开始的请求
+def crawl_pages(journal, seg, total, first_page, output, search_sql, cookies=None, headers=None):
+    pages = range(first_page, math.ceil(total / PAGE_SIZE) + 1)
+
+    def fetch(page):
+        return fetch_page(journal, seg[0], seg[1], page, search_sql, seg[2:], cookies, headers)
+
+    if page_workers <= 1:
+        for page in pages:
+            html = fetch(page)
+            if html is None:
+                return False
+            write_page(output, html, journal, page)
+        return True
+
+    futures = [get_executor().submit(fetch, page) for page in pages]
+    try:
+        for page, future in zip(pages, futures):
+            html = future.result()
+            if html is None:
+                return False
+            write_page(output, html, journal, page)
+    finally:
+        for future in futures:
+            future.cancel()
+    return True
+
+# 与crawl.start_crawl相同的调用方式，pool参数仅为兼容调度器，不使用浏览器
+# 检索结果超过MAX_NUM_PAPERS时由planner递归二分年份范围，单一年份仍超过时按月细分，所有子范围的结果写入同一输出文件
+def start_crawl(journal, start_year, end_year, output_file, pool=None):
+    print('Start crawling papers from {} published during {} - {}'.format(journal, start_year, end_year))
+    with telemetry.span('task', journal=journal, years='{}-{}'.format(start_year, end_year)) as attrs:
+        attrs['ok'] = crawl_papers(journal, start_year, end_year, output_file)
+        wait_enrichment()
+    return attrs['ok']
+
+# 等待本任务登记的文献详情补充完成
+def wait_enrichment():
+    details = enrich.get_enricher()
+    if details is None:
+        return
+    with telemetry.span('enrich_wait'):
+        details.wait()
+    print(details.summary())
+
+# 检索并保存所有页的文献信息
+def crawl_papers(journal, start_year, end_year, output_file):
+    global PAGE_SIZE
+    html, total = search_first(journal, start_year, end_year)
+    if total is None:
+        return False
+
+    # 每页解析后立即追加写入输出文件
+    output = sink.RowSink(output_file, page_size=PAGE_SIZE, dedup=dedup.get_store(), task=(journal, start_year, end_year))
+    try:
+        ok, plan = crawl_search(journal, start_year, end_year, html, total, output)
+    finally:
+        output.close()
+    if not ok:
+        return False
+    ok = output.commit()
+
+    print('Finish crawling papers from {} published in year: {} - {}, number of papers: {}, duplicates dropped: {}, expected number: {}, sub-queries: {}, {}'.format(
+        journal, start_year, end_year, output.rows, output.dropped, total, plan.leaves, rate_control.status()))
+    return ok
+
+# 检索并取得第一页，返回第一页的html与结果总数，失败时结果总数为None
+def search_first(journal, start_year, end_year):
+    html = fetch_page(journal, start_year, end_year, 1)
+    if html is None:
+        return None, None
+    total = page_parser.parse_total(html)
+    if total is None:
+        print('Paper number not found. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
+    return html, total
+
+# 从已取得的第一页html(结果总数为total)开始，由planner按需二分检索范围，将所有页按顺序写入output
+# output需提供write(rows)与page(已完成的页数)，返回(是否成功, planner)
+def crawl_search(journal, start_year, end_year, html, total, output):
+    global PAGE_SIZE, MAX_NUM_PAPERS
+    current = {'html': html}  # 最近一次检索的第一页
+
+    def search(seg):
+        html = fetch_page(journal, seg[0], seg[1], 1, months=seg[2:])
+        if html is None:
+            return None
+        current['html'] = html
+        return page_parser.parse_total(html)
+
+    # 第一页已在检索时取得，之后的页使用第一页返回的检索语句翻页
+    def crawl_leaf(seg, leaf_total, first_page):
+        search_sql = parse_search_sql(current['html'])
+        if first_page == 1:
+            write_page(output, current['html'], journal, 1)
+            first_page = 2
+        return crawl_pages(journal, seg, leaf_total, first_page, output, search_sql)
+
+    plan = planner.Planner(search, crawl_leaf, output, PAGE_SIZE, MAX_NUM_PAPERS, month_facets=True)
+    return plan.crawl(planner.segment(start_year, end_year), total), plan
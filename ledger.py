@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import os
+import csv
+import time
+import sqlite3
+import utils
+
+# 任务账本：用SQLite(WAL模式)记录每个(任务类型, 期刊, 年份范围)任务的状态、尝试次数、文献数、耗时与输出文件
+# 跳过已完成任务、统计缺失任务都通过索引查询完成，不再扫描输出目录
+# 多台机器共用同一账本时，各工作进程通过租约认领任务(claim)，租约过期未续期的任务(机器变慢或宕机)会被其他进程重新认领
+# 账本放在NFS等网络文件系统上时WAL模式不可用(依赖共享内存)，journal_mode应设为DELETE
+class Ledger(object):
+    def __init__(self, path='./tasks.db', kind='papers', journal_mode='WAL'):
+        self.path = path
+        self.kind = kind  # 任务类型，papers为文献信息，publish_num为发表数量
+        self.journal_mode = journal_mode
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode={}'.format(journal_mode))
+        self.conn.execute('PRAGMA synchronous={}'.format('NORMAL' if journal_mode.upper() == 'WAL' else 'FULL'))
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            kind TEXT NOT NULL,
+            journal TEXT NOT NULL,
+            start_year INTEGER NOT NULL,
+            end_year INTEGER NOT NULL,
+            output TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            rows INTEGER,
+            duration REAL,
+            updated_at REAL,
+            PRIMARY KEY (kind, journal, start_year, end_year))''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (kind, status)')
+        # 旧版本的账本没有租约列
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(tasks)')]
+        for column, type_ in (('lease_owner', 'TEXT'), ('lease_expires', 'REAL')):
+            if column not in columns:
+                self.conn.execute('ALTER TABLE tasks ADD COLUMN {} {}'.format(column, type_))
+
+    # 登记任务并返回未完成的任务列表与已完成的任务数
+    # 首次登记时输出文件已存在的任务(旧版本按文件名记录的进度)直接记为已完成
+    def schedule(self, tasks):
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN')
+            for journal, start_year, end_year, output_file in tasks:
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO tasks (kind, journal, start_year, end_year, output, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                    (self.kind, journal, start_year, end_year, output_file, now))
+                if cursor.rowcount and utils.output_exists(output_file):
+                    self.conn.execute('UPDATE tasks SET status = ? WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ?',
+                                      ('done', self.kind, journal, start_year, end_year))
+        pending, done = [], 0
+        for task in tasks:
+            if self.is_done(*task[:3]):
+                done += 1
+            else:
+                pending.append(task)
+        return pending, done
+
+    def is_done(self, journal, start_year, end_year):
+        row = self.conn.execute('SELECT status FROM tasks WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ?',
+                                (self.kind, journal, start_year, end_year)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    # 记录任务开始
+    def start(self, journal, start_year, end_year):
+        self.conn.execute('''UPDATE tasks SET status = 'running', attempts = attempts + 1, updated_at = ?
+                             WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ?''',
+                          (time.time(), self.kind, journal, start_year, end_year))
+
+    # 认领一个未完成、未被租用(或租约已过期)且尝试次数少于max_attempts的任务，租期为lease_seconds秒
+    # 用BEGIN IMMEDIATE保证多个进程(包括其他机器上的进程)不会认领同一任务，没有可认领的任务时返回None
+    def claim(self, owner, lease_seconds=600, max_attempts=3):
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute('''SELECT journal, start_year, end_year, output FROM tasks
+                                       WHERE kind = ? AND status != 'done' AND attempts < ?
+                                       AND (lease_expires IS NULL OR lease_expires < ?)
+                                       ORDER BY attempts, journal, start_year LIMIT 1''', (self.kind, max_attempts, now)).fetchone()
+            if row is not None:
+                self.conn.execute('''UPDATE tasks SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                                     lease_expires = ?, updated_at = ?
+                                     WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ?''',
+                                  (owner, now + lease_seconds, now, self.kind) + tuple(row[:3]))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return tuple(row) if row is not None else None
+
+    # 续租，任务已被其他进程接管(租约过期后被重新认领)时返回False
+    def renew(self, owner, journal, start_year, end_year, lease_seconds=600):
+        cursor = self.conn.execute('''UPDATE tasks SET lease_expires = ?
+                                       WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ? AND lease_owner = ?''',
+                                   (time.time() + lease_seconds, self.kind, journal, start_year, end_year, owner))
+        return cursor.rowcount > 0
+
+    # 尚未完成且仍可重试的任务数(包括其他进程正在执行的任务)
+    def outstanding(self, max_attempts=3):
+        return self.conn.execute("SELECT COUNT(*) FROM tasks WHERE kind = ? AND status != 'done' AND attempts < ?",
+                                 (self.kind, max_attempts)).fetchone()[0]
+
+    # 记录任务结束并释放租约，成功时统计输出文件中的文献数
+    # 租约模式下传入owner，只有仍持有租约时才记录，任务已被其他进程接管(租约过期后被重新认领)时不改写其状态与租约，返回False
+    def finish(self, journal, start_year, end_year, output_file, ok, duration, owner=None):
+        rows = count_rows(output_file) if ok else None
+        cursor = self.conn.execute('''UPDATE tasks SET status = ?, rows = ?, duration = ?, output = ?, updated_at = ?,
+                                       lease_owner = NULL, lease_expires = NULL
+                                       WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ?
+                                       AND (? IS NULL OR lease_owner = ?)''',
+                                   ('done' if ok else 'failed', rows, duration, output_file, time.time(),
+                                    self.kind, journal, start_year, end_year, owner, owner))
+        return cursor.rowcount > 0
+
+    # 将任务重新记为待爬取(如校验不通过)，并释放租约；任务已被其他进程重新认领时不改写，返回False
+    def requeue(self, journal, start_year, end_year):
+        cursor = self.conn.execute('''UPDATE tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL, updated_at = ?
+                                       WHERE kind = ? AND journal = ? AND start_year = ? AND end_year = ? AND lease_owner IS NULL''',
+                                   (time.time(), self.kind, journal, start_year, end_year))
+        return cursor.rowcount > 0
+
+    # 返回journals中(为None时为全部期刊)未完成的任务
+    def missing(self, journals=None):
+        rows = self.conn.execute('''SELECT journal, start_year, end_year, output FROM tasks
+                                    WHERE kind = ? AND status != 'done' ORDER BY journal, start_year''', (self.kind,)).fetchall()
+        if journals is not None:
+            journals = set(journals)
+            rows = [row for row in rows if row[0] in journals]
+        return [tuple(row) for row in rows]
+
+    # 各状态的任务数
+    def summary(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks WHERE kind = ? GROUP BY status', (self.kind,)).fetchall())
+
+    def close(self):
+        self.conn.close()
+
+# 统计输出文件(csv或xlsx)中的文献数
+def count_rows(output_file):
+    if not os.path.isfile(output_file):
+        return None
+    if output_file.endswith('.csv'):
+        with open(output_file, 'r', newline='', encoding='utf-8') as f:
+            return sum(1 for _ in csv.reader(f)) - 1
+    return len(utils.read_table(output_file))
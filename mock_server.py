@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import math
+import time
+import zlib
+import random
+import threading
+import argparse
+from urllib.parse import parse_qs, urlparse, quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import http_engine
+
+# 生成的替身知网：按期刊与年份确定性地生成文献，渲染与知网相同结构的检索结果(countPageDiv、perPageDiv、gridTable、
+# 页码与PageNext、发表年度分组)，并可注入响应延迟、验证码与超时，用于离线测量各爬取方式的吞吐量
+# papers_per_year为每个期刊每年的平均文献数，latency为每次检索请求的延迟(秒)，
+# captcha_after为翻页到超过该篇数时出现验证码(0表示不限制)，captcha_rate与timeout_rate为每次请求随机出现验证码与超时的概率，
+# 超时的请求在timeout秒后才返回错误
+class MockSite(object):
+    def __init__(self, papers_per_year=300, latency=0.0, captcha_after=0, captcha_rate=0.0, timeout_rate=0.0, timeout=30.0, seed=0):
+        self.papers_per_year = papers_per_year
+        self.latency = latency
+        self.captcha_after = captcha_after
+        self.captcha_rate = captcha_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = self.captchas = self.timeouts = 0
+        self.epoch = 0  # 增大时被引次数与被下载次数随之增长，用于模拟计数的变化
+
+    # 期刊journal在year年的文献数，在平均值的75%到125%之间
+    def count(self, journal, year):
+        return int(self.papers_per_year * (0.75 + (zlib.crc32('{}{}'.format(journal, year).encode('utf-8')) % 51) / 100))
+
+    # 检索范围内的所有文献，每篇为(篇名, 作者, 期刊名称, 发表时间, 被引次数, 被下载次数)
+    def papers(self, journal, start_year, end_year, months=None):
+        first, last = months or (1, 12)
+        result = []
+        for year in range(start_year, end_year + 1):
+            for i in range(self.count(journal, year)):
+                month = i % 12 + 1
+                if first <= month <= last:
+                    result.append(('{}论文{}-{}'.format(journal, year, i), '作者{}'.format(i % 97), journal,
+                                   '{}-{:02d}-{:02d}'.format(year, month, i % 28 + 1), str(i % 50 + self.epoch * (i % 3)),
+                                   str(i * 7 % 1000 + self.epoch * 10)))
+        return result
+
+    # 记录一次检索请求，按配置等待并返回需要注入的故障：None、'captcha'或'timeout'
+    def fault(self, page, size):
+        with self.lock:
+            self.pages += 1
+            value = self.random.random()
+        if self.latency:
+            time.sleep(self.latency)
+        if (self.captcha_after and (page - 1) * size >= self.captcha_after) or value < self.captcha_rate:
+            with self.lock:
+                self.captchas += 1
+            return 'captcha'
+        if value < self.captcha_rate + self.timeout_rate:
+            with self.lock:
+                self.timeouts += 1
+            time.sleep(self.timeout)
+            return 'timeout'
+        return None
+
+    # 渲染检索结果(总数、每页文献数、结果表格、页码与发表年度分组)
+    def render_results(self, journal, start_year, end_year, page=1, size=20, months=None):
+        papers = self.papers(journal, start_year, end_year, months)
+        pages = max(1, math.ceil(len(papers) / size))
+        page = max(1, min(page, pages))
+        parts = ['<input type="hidden" id="sqlVal" value="{}|{}|{}|{}">'.format(journal, start_year, end_year, size),
+                 '<div id="countPageDiv"><span class="pagerTitleCell">共找到<em>{:,}</em>条结果</span>'
+                 '<span class="countPageMark">{}/{}</span></div>'.format(len(papers), page, pages),
+                 '<div id="perPageDiv"><div class="sort-default"><span>{}</span></div><ul style="display:none">'.format(size)]
+        parts += ['<li data-val="{0}"><a href="javascript:void(0)">{0}</a></li>'.format(val) for val in (10, 20, 50)]
+        parts.append('</ul></div>')
+
+        years = {}
+        for paper in papers:
+            years[paper[3][:4]] = years.get(paper[3][:4], 0) + 1
+        parts.append('<dl class="is-up-fold off"><dt groupitem="发表年度">发表年度</dt><dd tit="发表年度"><div><ul>')
+        parts += ['<li><input type="checkbox" text="{0}" value="{0}"><span>({1})</span></li>'.format(year, years[year])
+                  for year in sorted(years, reverse=True)]
+        parts.append('</ul></div></dd></dl>')
+
+        parts.append('<div id="gridTable"><table><thead><tr><th></th><th>篇名</th><th>作者</th><th>刊名</th><th>发表时间</th>'
+                     '<th>被引</th><th>下载</th></tr></thead><tbody>')
+        for i, paper in enumerate(papers[(page - 1) * size:page * size]):
+            parts.append('<tr><td>{}</td><td class="name"><a href="/kcms/detail/detail.aspx?dbcode=CJFQ&amp;filename={}">{}</a></td>'
+                         '<td class="author"><a href="javascript:void(0)">{}</a></td><td class="source"><a href="javascript:void(0)">{}</a></td>'
+                         '<td class="date">{}</td><td class="quote"><a href="javascript:void(0)">{}</a></td>'
+                         '<td class="download"><a href="javascript:void(0)">{}</a></td></tr>'.format((page - 1) * size + i + 1, quote(paper[0]), *paper))
+        parts.append('</tbody></table></div><div class="pages">')
+        for p in range(max(1, page - 4), min(pages, page + 4) + 1):
+            if p == page:
+                parts.append('<span class="cur">{}</span>'.format(p))
+            else:
+                parts.append('<a href="javascript:void(0)" data-curpage="{0}">{0}</a>'.format(p))
+        if page < pages:
+            parts.append('<a id="PageNext" href="javascript:void(0)" data-curpage="{}">下一页</a>'.format(page + 1))
+        parts.append('</div>')
+        return ''.join(parts)
+
+    # 渲染文献详情页(摘要、关键词、DOI与基金)，filename为篇名
+    def render_detail(self, filename):
+        if self.latency:
+            time.sleep(self.latency)
+        key = zlib.crc32(filename.encode('utf-8'))
+        funds = '<p class="funds"><span><a>国家自然科学基金({});</a></span></p>'.format(key % 100000) if key % 3 else ''
+        return ('<html><head><meta charset="utf-8"></head><body><h1>{0}</h1><div class="row"><span id="ChDivSummary">{0}的摘要。</span></div>'
+                '<p class="keywords"><a>关键词{1};</a><a>关键词{2};</a></p>{3}'
+                '<ul><li class="top-space"><span class="rowtit">DOI：</span><p>10.{4}/{5:x}</p></li></ul></body></html>').format(
+                    filename, key % 7, key % 11, funds, 1000 + key % 9000, key)
+
+# 替身知网的首页与高级检索页面，高级检索页面用脚本请求并渲染检索结果，页面结构与crawl.py依赖的元素一致
+HOME_HTML = '<html><head><meta charset="utf-8"></head><body><a href="/kns/AdvSearch" target="_blank">高级检索</a></body></html>'
+CAPTCHA_HTML = '<div id="verifyCode" class="verify-wrap">请输入验证码</div>'
+ADV_SEARCH_HTML = '''<html><head><meta charset="utf-8"><title>高级检索</title>
+<style>.off dd { display: none; } #ChDivVerify { display: none; }</style></head>
+<body>
+<ul class="doctype-menus keji"><li data-id="xsqk"><a href="javascript:void(0)"><span>学术期刊</span></a></li></ul>
+<dl id="gradetxt"></dl>
+<input type="text" placeholder="起始年"><input type="text" placeholder="结束年">
+<input type="button" value="检索">
+<div id="ChDivVerify">请输入验证码</div>
+<div id="results"></div>
+<script>
+var state = {journal: '', start: '', end: '', page: 1, size: 20};
+function renderForm() {
+    document.getElementById('gradetxt').innerHTML = '<dd><div>主题</div></dd><dd><div>作者</div></dd>' +
+        '<dd><div>文献来源</div><div><div><div><span>文献来源</span></div></div><input type="text" data-tipid="gradetxt-3"></div></dd>';
+}
+function load() {
+    var body = new URLSearchParams({journal: state.journal, start: state.start, end: state.end, page: state.page, size: state.size});
+    fetch('/__GRID_PATH__', {method: 'POST', body: body}).then(function (response) {
+        return response.text();
+    }).then(function (html) {
+        if (html.indexOf('id="verifyCode"') >= 0) {
+            document.getElementById('ChDivVerify').style.display = 'block';
+            return;
+        }
+        document.getElementById('ChDivVerify').style.display = 'none';
+        document.getElementById('results').innerHTML = html;
+    });
+}
+document.addEventListener('click', function (e) {
+    var target = e.target;
+    if (target.closest('li[data-id="xsqk"]')) {
+        renderForm();
+    } else if (target.matches('input[value="检索"]')) {
+        state.journal = document.querySelector('#gradetxt input').value;
+        state.start = document.querySelector('input[placeholder="起始年"]').value;
+        state.end = document.querySelector('input[placeholder="结束年"]').value;
+        state.page = 1;
+        load();
+    } else if (target.closest('#perPageDiv li[data-val]')) {
+        state.size = parseInt(target.closest('li').getAttribute('data-val'));
+        state.page = 1;
+        load();
+    } else if (target.closest('#perPageDiv > div')) {
+        var ul = document.querySelector('#perPageDiv ul');
+        ul.style.display = ul.style.display == 'none' ? 'block' : 'none';
+    } else if (target.closest('a[data-curpage]')) {
+        e.preventDefault();
+        state.page = parseInt(target.closest('a').getAttribute('data-curpage'));
+        load();
+    } else if (target.closest('dt[groupitem]')) {
+        var dl = target.closest('dl');
+        dl.className = dl.className == 'is-up-fold off' ? 'is-up-fold' : 'is-up-fold off';
+    }
+});
+renderForm();
+</script>
+</body></html>'''.replace('__GRID_PATH__', http_engine.grid_path)
+
+# 本地替身服务器：回放http_engine.record_dir录制的检索结果页，便于离线运行和测试http_engine
+# 设置site(MockSite)时没有录制结果的检索由生成的替身知网响应，浏览器也可以在替身知网上完成检索与翻页
+# 同时提供代理池接口(/get/, /get_all/, /delete/)的替身，并可作为HTTP代理响应验证请求(/ip)，用于离线测试proxy_pool
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接
+    fixture_dir = './fixtures'
+    proxies = []  # 代理池接口返回的代理
+    site = None  # 生成的替身知网(MockSite)
+
+    def send_html(self, code, html):
+        body = html.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_form(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        return {key: values[0] for key, values in form.items()}
+
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        if parsed.path == '/get/':
+            self.send_json({'proxy': self.proxies[0]} if self.proxies else {'code': 0, 'src': 'no proxy'})
+        elif parsed.path == '/get_all/':
+            self.send_json([{'proxy': proxy} for proxy in self.proxies])
+        elif parsed.path == '/delete/':
+            if query.get('proxy') in self.proxies:
+                self.proxies.remove(query['proxy'])
+            self.send_json({'code': 0, 'src': 'success'})
+        elif parsed.path == '/ip':
+            self.send_json({'origin': self.client_address[0]})
+        elif parsed.path == '/kns/AdvSearch':
+            self.send_html(200, ADV_SEARCH_HTML)
+        elif parsed.path == '/kcms/detail/detail.aspx' and self.site is not None:
+            self.send_html(200, self.site.render_detail(query.get('filename', '')))
+        else:
+            self.send_html(200, HOME_HTML)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/' + http_engine.grid_path:
+            self.send_html(404, 'not found')
+            return
+        form = self.read_form()
+        if 'QueryJson' in form:
+            # http_engine的请求，优先回放录制的结果页
+            journal, start_year, end_year, months = http_engine.parse_query(form['QueryJson'])
+            page, size = int(form.get('CurPage', 1)), int(form.get('RecordsCntPerPage', http_engine.PAGE_SIZE))
+            name = http_engine.fixture_name(journal, start_year, end_year, page, months)
+            path = os.path.join(self.fixture_dir or '', name)
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.send_html(200, f.read())
+                return
+            if self.site is None:
+                self.send_html(404, 'fixture not found: {}'.format(name))
+                return
+        elif self.site is not None:
+            # 替身知网高级检索页面中脚本的请求
+            journal, months = form.get('journal', ''), None
+            start_year, end_year = int(form.get('start') or 1900), int(form.get('end') or 2100)
+            page, size = int(form.get('page', 1)), int(form.get('size', 20))
+        else:
+            self.send_html(400, 'bad request')
+            return
+
+        fault = self.site.fault(page, size)
+        if fault == 'captcha':
+            self.send_html(200, CAPTCHA_HTML)
+        elif fault == 'timeout':
+            self.send_html(504, 'timeout')
+        else:
+            self.send_html(200, self.site.render_results(journal, start_year, end_year, page, size, months))
+
+    def log_message(self, format, *args):
+        pass
+
+# 在后台线程中启动替身服务器，返回服务器对象及可赋值给http_engine.url的地址，port为0时自动选择端口
+def start_server(fixture_dir, port=0, handler=MockHandler, proxies=(), site=None):
+    handler = type(handler.__name__, (handler,), {'fixture_dir': fixture_dir, 'proxies': list(proxies), 'site': site})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage='python3 mock_server.py [fixture_dir] [--port PORT] [--site ...]')
+    parser.add_argument('fixture_dir', nargs='?', default=None, help='录制的检索结果页所在目录')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--proxies', nargs='*', default=[], help='代理池接口替身返回的代理(ip:port)')
+    parser.add_argument('--site', action='store_true', help='启用生成的替身知网，浏览器与http方式都可以在其上检索翻页')
+    parser.add_argument('--papers-per-year', type=int, default=300, help='替身知网中每个期刊每年的平均文献数')
+    parser.add_argument('--latency', type=float, default=0.0, help='每次检索请求的延迟(秒)')
+    parser.add_argument('--captcha-after', type=int, default=0, help='翻页超过该篇数时出现验证码，0表示不限制')
+    parser.add_argument('--captcha-rate', type=float, default=0.0, help='每次请求随机出现验证码的概率')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='每次请求随机超时的概率')
+    args = parser.parse_args()
+    site = None
+    if args.site:
+        site = MockSite(args.papers_per_year, args.latency, args.captcha_after, args.captcha_rate, args.timeout_rate)
+    server, address = start_server(args.fixture_dir, args.port, proxies=args.proxies, site=site)
+    print('Serving {} at {}'.format(args.fixture_dir or 'mock site', address))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
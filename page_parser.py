@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import re
+import json
+import lxml.html
+
+cols = ['篇名', '作者', '期刊名称', '发表时间', '被引次数', '被下载次数'] # 需要保存的信息种类
+col2index = {col: i + 1 for i, col in enumerate(cols)}  # 每种信息在表格行中的列下标
+columns = ['时间段'] + cols  # 输出文件的列，每篇文献以按columns顺序排列的元组表示
+link_cols = set(cols) - {'发表时间'}  # 这些列的信息取自单元格中的链接文本
+
+# 在浏览器中一次性提取整个结果表格，返回JSON字符串，每行为按cols顺序排列的文本列表
+GRID_SCRIPT = '''
+var spec = arguments[0];
+var trs = document.querySelectorAll('#gridTable > table > tbody > tr');
+var rows = [];
+for (var i = 0; i < trs.length; i++) {
+    var tds = trs[i].getElementsByTagName('td');
+    var row = [];
+    for (var k = 0; k < spec.length; k++) {
+        var td = tds[spec[k][0]];
+        var node = td && spec[k][1] ? td.getElementsByTagName('a')[0] : td;
+        row.push(node ? node.innerText : '');
+    }
+    rows.push(row);
+}
+return JSON.stringify(rows);
+'''
+GRID_SPEC = [[col2index[col], col in link_cols] for col in cols]
+
+# 合并连续空白并去掉首尾空白，与selenium中元素的text保持一致
+def clean(text):
+    return re.sub(r'\s+', ' ', text or '').strip()
+
+# 将按cols顺序排列的文本列表转换为一条文献记录
+def to_row(values, period='2012-2020'):
+    return (period,) + tuple(clean(value) for value in values)
+
+# 解析GRID_SCRIPT返回的JSON字符串
+def parse_grid_json(text):
+    return [to_row(values) for values in json.loads(text)]
+
+# 从页面源码中解析结果表格
+def parse_grid(html):
+    tree = lxml.html.fromstring(html)
+    result = []
+    for tr in tree.xpath('//*[@id="gridTable"]/table/tbody/tr'):
+        tds = tr.xpath('./td')
+        values = []
+        for col in cols:
+            index = col2index[col]
+            if index >= len(tds):
+                values.append('')
+            elif col in link_cols:
+                a = tds[index].xpath('.//a')
+                values.append(a[0].text_content() if a else '')
+            else:
+                values.append(tds[index].text_content())
+        result.append(to_row(values))
+    return result
+
+# 从页面源码中解析检索结果总数，找不到时返回None
+def parse_total(html):
+    ems = lxml.html.fromstring(html).xpath('//*[@id="countPageDiv"]/span[1]/em')
+    if not ems:
+        return None
+    return int(clean(ems[0].text_content()).replace(',', ''))
+
+# 在浏览器中取出结果表格每行篇名链接的地址(没有链接时为空字符串)，与GRID_SCRIPT的行一一对应
+LINK_SCRIPT = '''
+var trs = document.querySelectorAll('#gridTable > table > tbody > tr');
+var links = [];
+for (var i = 0; i < trs.length; i++) {
+    var td = trs[i].getElementsByTagName('td')[arguments[0]];
+    var a = td ? td.getElementsByTagName('a')[0] : null;
+    links.push(a ? a.getAttribute('href') || '' : '');
+}
+return links;
+'''
+
+# 从页面源码中解析结果表格每行篇名链接的地址，与parse_grid的行一一对应
+def parse_links(html):
+    tree = lxml.html.fromstring(html)
+    links = []
+    for tr in tree.xpath('//*[@id="gridTable"]/table/tbody/tr'):
+        hrefs = tr.xpath('./td[{}]//a/@href'.format(col2index['篇名'] + 1))
+        links.append(hrefs[0] if hrefs else '')
+    return links
+
+detail_cols = ['摘要', '关键词', 'DOI', '基金']  # 文献详情页中补充的信息
+
+# 从文献详情页中解析摘要、关键词、DOI与基金，返回按detail_cols顺序排列的元组，找不到的信息为空字符串
+def parse_detail(html):
+    tree = lxml.html.fromstring(html)
+    abstract = tree.xpath('//*[@id="ChDivSummary"]')
+    keywords = [clean(a.text_content()).rstrip(';；') for a in tree.xpath('//p[@class="keywords"]/a')]
+    funds = [clean(a.text_content()).rstrip(';；') for a in tree.xpath('//p[@class="funds"]//a')]
+    doi = tree.xpath('//span[@class="rowtit" and starts-with(normalize-space(), "DOI")]/following-sibling::p[1]')
+    return (clean(abstract[0].text_content()) if abstract else '', ';'.join(keyword for keyword in keywords if keyword),
+            clean(doi[0].text_content()) if doi else '', ';'.join(fund for fund in funds if fund))
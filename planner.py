@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import math
+
+MAX_NUM_PAPERS = 1500  # 检索结果超过该数量时翻页会出现验证码
+
+# 检索范围(起始年, 结束年, 起始月, 结束月)，月份只在单一年份时用于进一步细分
+def segment(start_year, end_year, start_month=1, end_month=12):
+    return (start_year, end_year, start_month, end_month)
+
+# 将检索范围二分：多年时按年份二分，单一年份且允许按月细分时按月份二分，无法再分时返回None
+def split(seg, month_facets=False):
+    start_year, end_year, start_month, end_month = seg
+    if start_year < end_year:
+        mid = (start_year + end_year) // 2
+        return [segment(start_year, mid), segment(mid + 1, end_year)]
+    if month_facets and start_month < end_month:
+        mid = (start_month + end_month) // 2
+        return [segment(start_year, start_year, start_month, mid), segment(start_year, start_year, mid + 1, end_month)]
+    return None
+
+def describe(seg):
+    start_year, end_year, start_month, end_month = seg
+    if (start_month, end_month) == (1, 12):
+        return '{} - {}'.format(start_year, end_year)
+    return '{}.{} - {}.{}'.format(start_year, start_month, end_year, end_month)
+
+# 检索结果数量超过上限时递归二分检索范围，按顺序爬取每个不超过上限的子范围，所有子范围的结果写入同一输出
+# search(seg)重新检索子范围并返回结果总数(失败返回None)，检索后页面显示该子范围的结果
+# crawl_leaf(seg, total, first_page)从第first_page页开始爬取当前显示的子范围，返回是否成功
+# output.page为输出中已完成的页数(含检查点)，各子范围的页按顺序累计，据此跳过已完成的子范围并从中断的页继续
+# 检索与爬取不能同步调用时(如async_crawl)可以不传search与crawl_leaf，由调用方按bisect与leaf的结果自行检索与爬取
+class Planner(object):
+    def __init__(self, search, crawl_leaf, output, page_size=50, max_papers=MAX_NUM_PAPERS, month_facets=False):
+        self.search = search
+        self.crawl_leaf = crawl_leaf
+        self.output = output
+        self.page_size = page_size
+        self.max_papers = max_papers
+        self.month_facets = month_facets
+        self.offset = 0  # 之前的子范围共有多少页
+        self.leaves = 0
+
+    # 爬取当前显示的检索范围seg，total为其结果总数
+    def crawl(self, seg, total):
+        parts = self.bisect(seg, total)
+        if parts is not None:
+            for part in parts:
+                part_total = self.search(part)
+                if part_total is None or not self.crawl(part, part_total):
+                    return False
+            return True
+        first_page = self.leaf(seg, total)
+        if first_page is None:
+            return True
+        return self.crawl_leaf(seg, total, first_page)
+
+    # 结果总数total超过上限且检索范围seg可以再分时返回两个子范围，否则返回None(直接爬取seg)
+    def bisect(self, seg, total):
+        if total <= self.max_papers:
+            return None
+        parts = split(seg, self.month_facets)
+        if parts is not None:
+            print('Number of papers: {} > {}, split {} into {} and {}.'.format(
+                total, self.max_papers, describe(seg), describe(parts[0]), describe(parts[1])))
+        else:
+            print('Number of papers: {} > {} in {}, which can not be split further.'.format(total, self.max_papers, describe(seg)))
+        return parts
+
+    # 按顺序登记一个直接爬取的子范围，返回应从哪一页开始爬取，该子范围在检查点之前已完成时返回None
+    def leaf(self, seg, total):
+        self.leaves += 1
+        pages = math.ceil(total / self.page_size)
+        done = self.output.page - self.offset
+        self.offset += pages
+        if done >= pages:
+            return None
+        return max(done, 0) + 1
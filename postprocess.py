@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import os
+import queue
+import threading
+import collections
+import pandas as pd
+import utils
+from ledger import Ledger
+
+# 流水线后处理：任务完成后立即交给后台线程校验与合并，不必等全部爬取结束后再运行utils.py
+# 校验：输出文件中的文献数加上去重时去掉的文献数(dedup.DedupStore记录)与同一次检索读取的发表数量
+# (counts_dir下与输出文件同名的csv)中的总数及各年份数量比较，
+# 不一致的任务在账本中重新记为pending，并放入requeued队列由调度器立即重新爬取(每个任务最多重试max_retries次)
+# 合并：一个期刊的所有输出文件都已存在且本次运行的任务都已通过校验时，立即合并为merge_dir下的期刊文件
+# journal_outputs为期刊名 -> 该期刊所有任务的输出文件列表(包括之前已完成的任务)，本次运行的任务由expect登记
+class PostProcessor(object):
+    def __init__(self, journal_outputs, merge_dir='./merged_output', counts_dir=None, max_retries=2, ledger_args=None, dedup=None):
+        self.journal_outputs = journal_outputs
+        self.merge_dir = merge_dir
+        self.counts_dir = counts_dir
+        self.max_retries = max_retries
+        self.ledger_args = ledger_args  # 创建账本连接的参数(路径, 任务类型, 日志模式)，为None时不更新账本
+        self.dedup = dedup  # 去重索引，为None时不计入去掉的重复文献
+        self.tasks = queue.Queue()
+        self.requeued = queue.Queue()
+        self.cond = threading.Condition()
+        self.pending = 0  # 已提交但尚未处理完的任务数
+        self.retries = collections.Counter()
+        self.awaiting = set()  # 尚未通过校验(未完成或等待重新爬取)的任务的输出文件
+        self.checked = self.invalid = self.merged = 0
+        self.thread = None
+
+    def start(self):
+        if not os.path.exists(self.merge_dir):
+            os.makedirs(self.merge_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    # 登记本次运行要执行的任务，这些任务通过校验前不合并其所在期刊
+    def expect(self, tasks):
+        self.awaiting.update(task[3] for task in tasks if task is not None)
+        return self
+
+    # 提交一个已结束的任务
+    def submit(self, task, ok):
+        with self.cond:
+            self.pending += 1
+        self.tasks.put((task, ok))
+
+    def run(self):
+        ledger = Ledger(*self.ledger_args) if self.ledger_args is not None else None
+        try:
+            for task, ok in iter(self.tasks.get, None):
+                try:
+                    self.process(task, ok, ledger)
+                except Exception as e:
+                    print('Post-processing error: {}. Task: {}.'.format(str(e), task))
+                with self.cond:
+                    self.pending -= 1
+                    self.cond.notify_all()
+        finally:
+            if ledger is not None:
+                ledger.close()
+
+    def process(self, task, ok, ledger):
+        journal, start_year, end_year, output_file = task
+        if not ok:
+            return
+        problem = self.validate(task)
+        self.checked += 1
+        if problem is not None:
+            self.invalid += 1
+            self.retries[task] += 1
+            if self.retries[task] <= self.max_retries:
+                print('Validation failed, re-queue task: {}. Task: {}.'.format(problem, task))
+                if ledger is not None:
+                    ledger.requeue(journal, start_year, end_year)
+                self.requeued.put(task)
+                return
+            print('Validation failed after {} retries: {}. Task: {}.'.format(self.max_retries, problem, task))
+        self.awaiting.discard(output_file)
+        self.merge(journal)
+
+    # 校验任务的输出文件，通过时返回None，否则返回不一致的原因；没有发表数量文件时不校验
+    def validate(self, task):
+        journal, start_year, end_year, output_file = task
+        if not self.counts_dir:
+            return None
+        counts_file = os.path.join(self.counts_dir, os.path.splitext(os.path.basename(output_file))[0] + '.csv')
+        if not os.path.isfile(counts_file):
+            return None
+        expected = pd.read_csv(counts_file, encoding='utf-8').iloc[0]
+
+        actual = collections.Counter()
+        file_name = utils.find_output(output_file)
+        if file_name is not None:
+            for row in utils.iter_table_rows(file_name, ['发表时间']):
+                actual[str(row[0] or '')[:4]] += 1
+        # 去重时去掉的文献同样属于这次检索的结果
+        if self.dedup is not None:
+            actual.update(self.dedup.dropped_counts((journal, start_year, end_year)))
+        total = sum(actual.values())
+        if total != int(expected['总数']):
+            return 'expected number: {}, actual number (including duplicates): {}'.format(int(expected['总数']), total)
+        for year in range(start_year, end_year + 1):
+            if str(year) in expected.index and actual[str(year)] != int(expected[str(year)]):
+                return 'year {}: expected number: {}, actual number: {}'.format(year, int(expected[str(year)]), actual[str(year)])
+        return None
+
+    # 期刊的所有输出文件都已存在且都已通过校验时合并
+    def merge(self, journal):
+        outputs = self.journal_outputs.get(journal, [])
+        files = [utils.find_output(output_file) for output_file in outputs]
+        if not files or None in files or any(output_file in self.awaiting for output_file in outputs):
+            return
+        if utils.merge_journal(files, os.path.join(self.merge_dir, journal + '.xlsx')):
+            self.merged += 1
+            print('Merged journal {} into {}.'.format(journal, self.merge_dir))
+
+    # 等待所有已提交的任务处理完成
+    def wait_idle(self):
+        with self.cond:
+            while self.pending > 0:
+                self.cond.wait()
+
+    # 取出所有需要重新爬取的任务
+    def drain(self):
+        tasks = []
+        while True:
+            try:
+                tasks.append(self.requeued.get_nowait())
+            except queue.Empty:
+                return tasks
+
+    def close(self):
+        self.wait_idle()
+        self.tasks.put(None)
+        if self.thread is not None:
+            self.thread.join()
+
+    def summary(self):
+        return 'Post-processing: checked: {}, invalid: {}, journals merged: {}'.format(self.checked, self.invalid, self.merged)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# 代理管理器：后台线程从代理池接口(proxy_pool)获取候选代理并并发验证，缓存健康的代理及其延迟与成功率，
+# 淘汰失败的代理，需要代理时立即返回得分最高的代理，不再在启动浏览器时同步验证
+class ProxyManager(object):
+    def __init__(self, api='http://127.0.0.1:5010/', check_url='http://httpbin.org/ip', min_healthy=4,
+                 max_failures=3, interval=10, timeout=5, workers=8):
+        self.api = api
+        self.check_url = check_url
+        self.min_healthy = min_healthy  # 健康代理少于该数量时补充候选代理
+        self.max_failures = max_failures  # 连续失败达到该次数的代理被淘汰
+        self.interval = interval  # 后台验证的间隔(秒)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(workers)
+        self.cond = threading.Condition()
+        self.stats = {}  # 代理 -> {'latency': 平均延迟, 'success': 成功次数, 'failure': 连续失败次数}
+        self.running = False
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+
+    # 后台循环：健康代理不足时补充候选，并定期重新验证已缓存的代理
+    def run(self):
+        while self.running:
+            candidates = list(self.stats)
+            if len(candidates) < self.min_healthy:
+                candidates += [proxy for proxy in self.fetch_candidates() if proxy not in self.stats]
+            list(self.executor.map(self.validate, candidates))
+            with self.cond:
+                self.cond.wait(self.interval)
+
+    # 从代理池接口获取候选代理
+    def fetch_candidates(self):
+        try:
+            proxies = requests.get(self.api + 'get_all/', timeout=self.timeout).json()
+            return [item['proxy'] for item in proxies if item.get('proxy')]
+        except (requests.RequestException, ValueError, TypeError, KeyError):
+            pass
+        try:
+            proxy = requests.get(self.api + 'get/', timeout=self.timeout).json().get('proxy')
+            return [proxy] if proxy else []
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            print('Failed to get proxy from {}: {}'.format(self.api, str(e)))
+            return []
+
+    # 通过代理访问check_url验证代理，并记录结果
+    def validate(self, proxy):
+        start_time = time.time()
+        try:
+            requests.get(self.check_url, proxies={'http': 'http://' + proxy, 'https': 'http://' + proxy},
+                         timeout=self.timeout).raise_for_status()
+        except requests.RequestException:
+            self.report(proxy, False)
+            return False
+        self.report(proxy, True, time.time() - start_time)
+        return True
+
+    # 记录代理的一次使用结果，连续失败过多时淘汰并从代理池接口中删除
+    def report(self, proxy, ok, latency=None):
+        with self.cond:
+            stat = self.stats.setdefault(proxy, {'latency': self.timeout, 'success': 0, 'failure': 0})
+            if ok:
+                stat['success'] += 1
+                stat['failure'] = 0
+                if latency is not None:
+                    stat['latency'] = 0.7 * stat['latency'] + 0.3 * latency
+                self.cond.notify_all()
+                return
+            stat['failure'] += 1
+            if stat['failure'] < self.max_failures and stat['success'] > 0:
+                return
+            del self.stats[proxy]
+        self.delete(proxy)
+
+    def delete(self, proxy):
+        try:
+            requests.get(self.api + 'delete/', params={'proxy': proxy}, timeout=self.timeout)
+        except requests.RequestException:
+            pass
+
+    # 代理得分：成功率越高、延迟越低得分越高
+    def score(self, stat):
+        rate = (stat['success'] + 1) / (stat['success'] + stat['failure'] + 2)
+        return rate / (stat['latency'] + 0.1)
+
+    # 返回得分最高的健康代理，暂无健康代理时最多等待timeout秒，仍没有则返回None
+    def get(self, timeout=60):
+        self.start()
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                healthy = [(self.score(stat), proxy) for proxy, stat in self.stats.items() if stat['success'] > 0]
+                if healthy:
+                    return max(healthy)[1]
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def summary(self):
+        with self.cond:
+            healthy = sum(1 for stat in self.stats.values() if stat['success'] > 0)
+        return 'Proxy pool: healthy: {}, cached: {}'.format(healthy, len(self.stats))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import time
+import threading
+
+# 自适应翻页速率控制(AIMD)：翻页成功且响应时间正常时按固定步长提高速率(缩短间隔)，
+# 响应变慢、超时或出现验证码时成倍降低速率(延长间隔)，从而在网站能承受的范围内尽可能快地翻页
+# 除全局间隔外，每个代理(key)另有独立的间隔，同一代理的请求同时受两者限制
+class RateController(object):
+    def __init__(self, initial_delay=1.0, min_delay=0.2, max_delay=30.0, increase=0.1, decrease=2.0,
+                 slow_factor=2.0, captcha_cooldown=15.0):
+        self.min_delay = max(min_delay, 0.001)  # 间隔不能为0，否则无法换算为速率
+        self.max_delay = max_delay
+        self.increase = increase  # 每次成功后速率(页/秒)增加的步长
+        self.decrease = decrease  # 失败时间隔放大的倍数
+        self.slow_factor = slow_factor  # 响应时间超过平均值的该倍数时视为变慢
+        self.captcha_cooldown = captcha_cooldown  # 出现验证码后暂停的时间(秒)
+        self.lock = threading.Lock()
+        self.delays = {None: max(initial_delay, self.min_delay)}  # 全局(None)与每个代理的翻页间隔
+        self.next_times = {None: 0.0}  # 全局与每个代理下一次允许翻页的时间
+        self.latency = None  # 响应时间的指数移动平均
+        self.pages = self.errors = self.captchas = 0
+        self.start_time = time.time()
+
+    # 预约一次翻页，返回需要等待的秒数
+    def reserve(self, key=None):
+        with self.lock:
+            now = time.time()
+            if key not in self.delays:
+                self.delays[key] = self.delays[None]
+                self.next_times[key] = 0.0
+            start = max(now, self.next_times[None], self.next_times[key])
+            self.next_times[None] = start + self.delays[None]
+            self.next_times[key] = start + self.delays[key]
+            return start - now
+
+    # 等待直到允许翻页
+    def wait(self, key=None):
+        seconds = self.reserve(key)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # 记录一次翻页的结果，latency为响应时间(秒)，据此调整全局与该代理的间隔
+    def record(self, latency=None, ok=True, captcha=False, key=None):
+        with self.lock:
+            self.pages += 1
+            slow = False
+            if latency is not None:
+                slow = self.latency is not None and latency > self.slow_factor * self.latency
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+            if captcha:
+                self.captchas += 1
+            elif not ok:
+                self.errors += 1
+            for k in set([None, key]):
+                delay = self.delays.get(k, self.delays[None])
+                if captcha or not ok or slow:
+                    delay = delay * self.decrease
+                else:
+                    delay = 1 / (1 / delay + self.increase)
+                self.delays[k] = min(self.max_delay, max(self.min_delay, delay))
+                if captcha:
+                    self.next_times[k] = time.time() + self.captcha_cooldown
+
+    # 当前速率与间隔，用于输出进度
+    def status(self):
+        with self.lock:
+            delay = self.delays[None]
+            return 'rate: {:.2f} pages/s, delay: {:.2f}s, latency: {:.2f}s, errors: {}, captchas: {}'.format(
+                1 / delay, delay, self.latency or 0, self.errors, self.captchas)
+
+# 每个进程共用一个速率控制器，各爬取方式都通过它控制翻页间隔
+controller = RateController()
+
+def status():
+    return controller.status()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import time
+import sqlite3
+import argparse
+import functools
+import threading
+import openpyxl
+import page_parser
+import dedup
+import http_engine
+import rate_control
+import scheduler
+import telemetry
+import utils
+
+# 增量更新已爬取文献的被引次数与被下载次数：篇名、作者、发表时间等不会变化，只有这两列经常变化，
+# 因此不必删除输出文件重新爬取。用http方式重新检索每个已完成任务的各页，按文献指纹与输出文件中的文献对应，
+# 只改写计数有变化的文献(无变化时不改写文件)，并在count_history中保留每篇文献最近几次的计数
+count_cols = ['被引次数', '被下载次数']
+
+# 计数的历史快照：以(文献指纹, 记录时间)为主键的SQLite表(WAL模式，多个工作进程可共用)，每篇文献保留最近keep次
+class CountHistory(object):
+    def __init__(self, path='./count_history.db', keep=10):
+        self.path = path
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS count_history (
+            fp BLOB NOT NULL,
+            output TEXT NOT NULL,
+            cited TEXT,
+            downloads TEXT,
+            recorded_at REAL NOT NULL,
+            PRIMARY KEY (fp, recorded_at)) WITHOUT ROWID''')
+
+    # 记录计数变化的文献，changes为(指纹, 旧计数, 新计数)列表，since为旧计数的记录时间(输出文件的修改时间)
+    # 没有历史的文献先记录旧计数作为基准
+    def record(self, output_file, changes, since):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for fp, old, new in changes:
+                    if self.conn.execute('SELECT 1 FROM count_history WHERE fp = ? LIMIT 1', (fp,)).fetchone() is None:
+                        self.conn.execute('INSERT OR REPLACE INTO count_history VALUES (?, ?, ?, ?, ?)', (fp, output_file) + tuple(old) + (since,))
+                    self.conn.execute('INSERT OR REPLACE INTO count_history VALUES (?, ?, ?, ?, ?)', (fp, output_file) + tuple(new) + (now,))
+                    self.conn.execute('''DELETE FROM count_history WHERE fp = ? AND recorded_at NOT IN
+                        (SELECT recorded_at FROM count_history WHERE fp = ? ORDER BY recorded_at DESC LIMIT ?)''', (fp, fp, self.keep))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    def close(self):
+        self.conn.close()
+
+path = './count_history.db'  # 历史快照路径，为空时不记录历史
+keep = 10
+history = None
+
+# 每个进程共用一个历史快照表，首次使用时打开
+def get_history():
+    global history
+    if history is None and path:
+        history = CountHistory(path, keep)
+    return history
+
+# 收集重新检索得到的每篇文献的计数，作为http_engine.crawl_search的输出(不从检查点继续，page从0开始)
+class CountCollector(object):
+    def __init__(self, columns=page_parser.columns):
+        self.columns = columns
+        self.indexes = [columns.index(col) for col in count_cols]
+        self.counts = {}  # 指纹 -> (被引次数, 被下载次数)
+        self.page = 0
+
+    def write(self, rows):
+        for row in rows:
+            self.counts[dedup.fingerprint(row, self.columns)] = tuple(str(row[i]) for i in self.indexes)
+        self.page += 1
+
+# 把counts中的计数写入结果文件(csv或xlsx)中对应的文献，有变化时原子地改写文件
+# 返回(计数有变化的文献的(指纹, 旧计数, 新计数)列表, 文件中的文献数, 文件中没有重新检索到的文献数)
+def update_counts(file_name, counts):
+    if file_name.endswith('.csv'):
+        with open(file_name, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        header, body = rows[0], rows[1:]
+        wb = None
+    else:
+        wb = openpyxl.load_workbook(file_name)
+        ws = wb.active
+        header = [cell.value for cell in ws[1]]
+        body = [list(cells) for cells in ws.iter_rows(min_row=2)]
+    indexes = [header.index(col) for col in count_cols]
+    changes, missing = [], 0
+    for row in body:
+        values = [cell.value for cell in row] if wb is not None else row
+        fp = dedup.fingerprint(values, header)
+        new = counts.get(fp)
+        if new is None:
+            missing += 1
+            continue
+        old = tuple('' if values[i] is None else str(values[i]) for i in indexes)
+        if old == new:
+            continue
+        changes.append((fp, old, new))
+        for i, value in zip(indexes, new):
+            if wb is not None:
+                row[i].value = int(value) if value.isdigit() else value
+            else:
+                row[i] = value
+    if changes:
+        tmp_file = file_name + '.tmp'
+        if wb is not None:
+            wb.save(tmp_file)
+        else:
+            with open(tmp_file, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows([header] + body)
+        os.replace(tmp_file, file_name)
+    return changes, len(body), missing
+
+# 重新检索期刊journal在start_year到end_year间的文献，更新output_file中的计数，与crawl.start_crawl相同的调用方式
+def refresh_counts(journal, start_year, end_year, output_file, pool=None):
+    file_name = utils.find_output(output_file)
+    if file_name is None:
+        print('Output file not found, skip refreshing. Journal: {}, year: {} - {}.'.format(journal, start_year, end_year))
+        return False
+    print('Start refreshing counts of papers from {} published during {} - {}'.format(journal, start_year, end_year))
+    with telemetry.span('refresh', journal=journal, years='{}-{}'.format(start_year, end_year)):
+        html, total = http_engine.search_first(journal, start_year, end_year)
+        if total is None:
+            return False
+        collector = CountCollector()
+        ok, plan = http_engine.crawl_search(journal, start_year, end_year, html, total, collector)
+        if not ok:
+            return False
+        since = os.path.getmtime(file_name)
+        changes, num_rows, missing = update_counts(file_name, collector.counts)
+        if changes and get_history() is not None:
+            get_history().record(output_file, changes, since)
+    print('Finish refreshing counts of papers from {} published in year: {} - {}, papers: {}, changed: {}, not found: {}, new: {}, {}'.format(
+        journal, start_year, end_year, num_rows, len(changes), missing, max(0, len(collector.counts) - (num_rows - missing)),
+        rate_control.status()))
+    return True
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(usage='python3 refresh.py [start end] [options]')
+    parser.add_argument('start', type=int, nargs='?', default=0, help='起始期刊下标(默认为第一个期刊)')
+    parser.add_argument('end', type=int, nargs='?', default=sys.maxsize, help='结束期刊下标(默认为最后一个期刊)')
+    parser.add_argument('--output-dir', default='./output', help='crawl.py的输出目录')
+    parser.add_argument('--history', default='./count_history.db', help='计数历史快照(SQLite)路径，为空字符串时不记录')
+    parser.add_argument('--keep', type=int, default=10, help='每篇文献保留的历史快照数')
+    parser.add_argument('--workers', type=int, default=1, help='并行更新的工作进程数')
+    parser.add_argument('--page-workers', type=int, default=1, help='并发请求同一检索各页的线程数')
+    parser.add_argument('--url', default=None, help='知网地址(可指向mock_server)')
+    parser.add_argument('--min-delay', type=float, default=0.2, help='自适应翻页间隔的下限(秒)')
+    parser.add_argument('--max-delay', type=float, default=30, help='自适应翻页间隔的上限(秒)')
+    return parser.parse_args(argv)
+
+# 根据命令行参数设置全局配置，同时作为工作进程的初始化函数
+def configure(args):
+    global path, keep
+    path, keep = args.history, args.keep
+    http_engine.page_workers = args.page_workers
+    rate_control.controller = rate_control.RateController(min_delay=args.min_delay, max_delay=args.max_delay)
+    if args.url:
+        http_engine.url = args.url
+
+def main():
+    args = parse_args()
+    sys.stdout = telemetry.Logger('refresh.log')
+    configure(args)
+    start_time = time.time()
+    print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
+
+    # 与crawl.py相同的期刊与年份范围，只更新输出文件已存在的任务
+    ori_src, new_src = './待爬取数据.xlsx', './journals.txt'
+    utils.excel2txt(ori_src, new_src)
+    journals = utils.read_txt(new_src, args.start, args.end)
+    start_years = [2012, 2015, 2018]
+    end_years = [2014, 2017, 2020]
+    tasks = [(journal, start_years[j], end_years[j], args.output_dir + '/' + journal + str(j + 1) + '.csv')
+             for journal in journals for j in range(len(start_years))]
+    existing = [task for task in tasks if utils.find_output(task[3]) is not None]
+
+    succeed, failed = scheduler.run_tasks(existing, refresh_counts, args.workers, None, len(tasks) - len(existing), start_time,
+                                          init=functools.partial(configure, args), status=rate_control.status)
+    print('Finished refresh. Total succeed: {}, total failed: {}, total skipped: {}, total used time: {}'.format(
+        succeed, failed, len(tasks) - len(existing), time.time() - start_time))
+
+if __name__ == '__main__':
+    main()
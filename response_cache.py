@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import threading
+
+# 检索结果页的磁盘缓存：以请求(期刊、年份范围、月份范围、页码、每页文献数)的SHA-1摘要为键，
+# 压缩后的html保存在SQLite表中(WAL模式，多个工作进程可共用)
+# 超过ttl秒的缓存视为过期(ttl为0时不过期)，总大小超过max_bytes时按最近访问时间淘汰最久未用的页，直到降到max_bytes的90%
+# replay为True时只从缓存读取(忽略过期时间)，缓存中没有的页视为失败，不产生任何网络请求
+class ResponseCache(object):
+    def __init__(self, path='./responses.db', ttl=7 * 24 * 3600, max_bytes=2 * 1024 ** 3, replay=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key BLOB PRIMARY KEY,
+            request TEXT NOT NULL,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL) WITHOUT ROWID''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self.hits = self.misses = self.evicted = 0
+        # 缓存总大小，多个进程共用缓存时只是估计值，淘汰前重新统计
+        self.total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    # 请求的键与规范化的请求描述
+    @staticmethod
+    def make_key(journal, start_year, end_year, page, page_size, months=None):
+        request = json.dumps([journal, int(start_year), int(end_year), list(months or (1, 12)), int(page), int(page_size)],
+                             ensure_ascii=False)
+        return hashlib.sha1(request.encode('utf-8')).digest(), request
+
+    # 读取缓存的页，没有或已过期时返回None
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute('SELECT body, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None or (not self.replay and self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.hits += 1
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    # 缓存一页，并在超过大小上限时淘汰最久未用的页
+    def put(self, key, request, html):
+        body = zlib.compress(html.encode('utf-8'), 6)
+        now = time.time()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO responses (key, request, body, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)',
+                              (key, request, body, len(body), now, now))
+            self.total += len(body)
+            if self.max_bytes and self.total > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        self.total = total
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, size in self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+                if total <= target:
+                    break
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                total -= size
+                self.evicted += 1
+            self.conn.execute('COMMIT')
+            self.total = total
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    # 删除已过期的页，返回删除的页数
+    def purge(self):
+        if not self.ttl:
+            return 0
+        with self.lock:
+            return self.conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,)).rowcount
+
+    def close(self):
+        self.conn.close()
+
+    def summary(self):
+        return 'Response cache: hits: {}, misses: {}, evicted: {}'.format(self.hits, self.misses, self.evicted)
+
+path = None  # 缓存路径，为None时不缓存
+ttl = 7 * 24 * 3600
+max_bytes = 2 * 1024 ** 3
+replay = False
+cache = None
+
+# 每个进程共用一个缓存，首次使用时打开，未设置path时返回None
+def get_cache():
+    global cache
+    if cache is None and path:
+        cache = ResponseCache(path, ttl, max_bytes, replay)
+    return cache
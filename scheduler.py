@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import multiprocessing
+import queue
+import time
+import os
+import sys
+import socket
+import threading
+import collections
+import sink
+import telemetry
+import browser_pool
+from ledger import Ledger
+
+# 租约模式的配置：lease_seconds为租期(秒)，max_attempts为每个任务的最大尝试次数，
+# poll为暂时没有可认领的任务(其他进程仍在执行)时重新认领的间隔(秒)
+class Lease(object):
+    def __init__(self, lease_seconds=600, max_attempts=3, poll=30):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.poll = poll
+
+# 续租线程：任务执行期间每隔租期的三分之一续租一次，使用自己的账本连接
+# 续租失败(任务已被其他进程接管)时停止向该任务的输出文件写入，本进程的爬取随之失败结束
+class LeaseKeeper(threading.Thread):
+    def __init__(self, ledger, owner, task, lease_seconds):
+        super(LeaseKeeper, self).__init__(daemon=True)
+        self.ledger_args = (ledger.path, ledger.kind, ledger.journal_mode)
+        self.owner = owner
+        self.task = task
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        ledger = Ledger(*self.ledger_args)
+        try:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not ledger.renew(self.owner, *self.task[:3], lease_seconds=self.lease_seconds):
+                    print('Lease lost, task was taken over by another worker, stop crawling. Task: {}.'.format(self.task))
+                    sink.cancel(self.task[3])
+                    return
+        finally:
+            ledger.close()
+
+    def stop(self):
+        self.stopped.set()
+
+# 认领者标识：主机名与进程号
+def lease_owner():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+# 从共享的任务账本中不断认领任务，暂时没有可认领的任务但仍有任务未完成(正由其他进程执行)时等待，
+# 以便在其租约过期后接管，所有任务完成(或达到最大尝试次数)后结束
+# 传入post(postprocess.PostProcessor)时结束前等待后处理校验完已完成的任务，校验不通过而重新记为待爬取的任务继续认领
+def claim_tasks(ledger, lease, post=None):
+    owner = lease_owner()
+    while True:
+        task = ledger.claim(owner, lease.lease_seconds, lease.max_attempts)
+        if task is not None:
+            yield task
+        elif ledger.outstanding(lease.max_attempts) > 0:
+            time.sleep(lease.poll)
+        elif post is None:
+            return
+        else:
+            post.wait_idle()
+            if ledger.outstanding(lease.max_attempts) == 0:
+                return
+
+# 执行一个任务，传入任务账本时记录任务的开始、结束、耗时与文献数
+# 租约模式下任务已由claim记为开始，执行期间由续租线程定期续租
+def run_task(crawl, task, pool=None, ledger=None, lease=None):
+    journal, start_year, end_year, output_file = task
+    keeper = None
+    if ledger is not None:
+        if lease is None:
+            ledger.start(journal, start_year, end_year)
+        else:
+            keeper = LeaseKeeper(ledger, lease_owner(), task, lease.lease_seconds)
+            keeper.start()
+    start_time = time.time()
+    try:
+        ok = crawl(*task, pool=pool)
+    except Exception as e:
+        print('Unexpected error: {}. Task: {}.'.format(str(e), task))
+        ok = False
+    if keeper is not None:
+        keeper.stop()
+    if ledger is not None:
+        owner = lease_owner() if lease is not None else None
+        if not ledger.finish(journal, start_year, end_year, output_file, ok, time.time() - start_time, owner):
+            print('Task was taken over by another worker, result is not recorded. Task: {}.'.format(task))
+            ok = False
+    return ok
+
+# 工作进程：每个进程使用自己的浏览器池(即自己的浏览器)与任务账本连接，从任务队列中取任务执行，并将结果放入结果队列
+# 任务为(期刊名, 起始年, 结束年, 输出文件)，队列中取到None表示没有更多任务；租约模式下从任务账本中认领任务
+def worker(crawl, make_pool, task_queue, result_queue, init=None, make_ledger=None, status=None, lease=None):
+    if init is not None:
+        init()
+    pool = make_pool() if make_pool is not None else None
+    ledger = make_ledger() if make_ledger is not None else None
+    try:
+        tasks = claim_tasks(ledger, lease) if lease is not None else iter(task_queue.get, None)
+        for task in tasks:
+            ok = run_task(crawl, task, pool, ledger, lease)
+            result_queue.put((task, ok, status() if status is not None else ''))
+    finally:
+        if ledger is not None:
+            ledger.close()
+        if pool is not None:
+            pool.close()
+            result_queue.put((None, (pool.tasks, pool.launches, pool.recycled), ''))
+        # 子进程退出时不执行atexit注册的函数，需要在此写出计时结果与日志
+        if telemetry.summary() is not None:
+            print('Worker {}: {}'.format(os.getpid(), telemetry.summary()))
+        telemetry.flush()
+        sys.stdout.flush()
+
+# 用num_workers个进程并行执行tasks中的任务，并汇总各进程的成功、失败数量
+# crawl、make_pool、init、make_ledger与status需为模块级函数(或functools.partial)，以便传递给子进程
+# init在每个工作进程启动时执行一次，status返回的文本(如当前翻页速率)附加在进度信息之后
+# 传入lease(Lease)时为租约模式：忽略tasks，各工作进程从make_ledger()返回的共享账本中认领任务，可在多台机器上同时运行
+# 传入post(postprocess.PostProcessor)时每个任务结束后提交给后处理，校验不通过而放回的任务立即重新执行
+# (租约模式下由后处理在账本中重新记为待爬取，由各工作进程重新认领)
+def run_tasks(tasks, crawl, num_workers=1, make_pool=None, skipped=0, start_time=None, init=None, make_ledger=None,
+              status=None, lease=None, post=None):
+    start_time = start_time or time.time()
+    if lease is not None:
+        ledger = make_ledger()
+        tasks = [None] * ledger.outstanding(lease.max_attempts)  # 仅用于显示进度，实际任务在执行时认领
+        ledger.close()
+    cnt, total = skipped, len(tasks) + skipped
+    succeed = failed = 0
+    pool_stats = [0, 0, 0]
+
+    def on_result(task, ok, text=''):
+        nonlocal cnt, succeed, failed
+        cnt += 1
+        if ok:
+            succeed += 1
+        else:
+            failed += 1
+        print('Progress: {}/{}, succeed: {}, failed: {}, skipped: {}, used time: {}{}'.format(
+            cnt, total, succeed, failed, skipped, time.time() - start_time, ', ' + text if text else ''))
+        if post is not None:
+            post.submit(task, ok)
+
+    # 取出后处理放回的任务交给put，返回任务数
+    def requeue(put):
+        nonlocal total
+        requeued = post.drain() if post is not None and lease is None else []
+        for task in requeued:
+            put(task)
+        total += len(requeued)
+        return len(requeued)
+
+    # 单进程时直接在当前进程中执行，保持原有的串行行为
+    if num_workers <= 1:
+        pool = make_pool() if make_pool is not None else None
+        ledger = make_ledger() if make_ledger is not None else None
+
+        def serial_tasks():
+            if lease is not None:
+                yield from claim_tasks(ledger, lease, post)
+                return
+            todo = collections.deque(tasks)
+            while True:
+                requeue(todo.append)
+                if not todo and post is not None:
+                    post.wait_idle()
+                    requeue(todo.append)
+                if not todo:
+                    return
+                yield todo.popleft()
+
+        try:
+            for task in serial_tasks():
+                ok = run_task(crawl, task, pool, ledger, lease)
+                on_result(task, ok, status() if status is not None else '')
+        finally:
+            if ledger is not None:
+                ledger.close()
+            if pool is not None:
+                pool.close()
+                pool_stats = [pool.tasks, pool.launches, pool.recycled]
+    else:
+        # 租约模式下工作进程认领完所有任务后即退出，之后由后处理重新记为待爬取的任务需要再启动工作进程认领
+        while True:
+            task_queue, result_queue = multiprocessing.Queue(), multiprocessing.Queue()
+            if lease is None:
+                for task in tasks:
+                    task_queue.put(task)
+            num_workers = min(num_workers, max(1, len(tasks)))
+            procs = [multiprocessing.Process(target=worker, args=(crawl, make_pool, task_queue, result_queue, init, make_ledger, status, lease))
+                     for _ in range(num_workers)]
+            for proc in procs:
+                proc.start()
+
+            finished = done = 0
+            expected, stopping = len(tasks), False
+            expected_stats = num_workers if make_pool is not None else 0
+            while True:
+                if lease is None:
+                    expected += requeue(task_queue.put)
+                    # 所有任务(包括放回的任务)都已完成且后处理没有再放回任务时通知工作进程退出
+                    if done >= expected and not stopping:
+                        if post is not None:
+                            post.wait_idle()
+                            requeued = requeue(task_queue.put)
+                            if requeued:
+                                expected += requeued
+                                continue
+                        for _ in range(num_workers):
+                            task_queue.put(None)
+                        stopping = True
+                    if stopping and finished >= expected_stats:
+                        break
+                # 租约模式下任务数不确定(其他机器也在认领)，等待所有工作进程结束
+                elif not any(proc.is_alive() for proc in procs) and result_queue.empty():
+                    break
+                try:
+                    task, result, text = result_queue.get(timeout=5)
+                except queue.Empty:
+                    # 所有工作进程都已退出(如异常崩溃)时不再等待
+                    if not any(proc.is_alive() for proc in procs):
+                        if lease is None and done < expected:
+                            print('All workers exited, {} tasks unfinished.'.format(expected - done))
+                        break
+                    continue
+                if task is None:
+                    finished += 1
+                    pool_stats = [a + b for a, b in zip(pool_stats, result)]
+                else:
+                    done += 1
+                    on_result(task, result, text)
+            for proc in procs:
+                proc.join()
+
+            if lease is None or post is None:
+                break
+            post.wait_idle()
+            ledger = make_ledger()
+            outstanding = ledger.outstanding(lease.max_attempts)
+            ledger.close()
+            if outstanding == 0:
+                break
+            total += outstanding
+            print('{} tasks re-queued by post-processing, restart workers.'.format(outstanding))
+
+    if make_pool is not None:
+        print(browser_pool.summary(*pool_stats))
+    return succeed, failed
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import os
+import csv
+import json
+import threading
+import page_parser
+
+# 已失去租约的任务的输出文件：任务已被其他工作进程接管，两者会写入同一临时文件，本进程不能再写入
+cancelled = set()
+cancelled_lock = threading.Lock()
+
+class TaskCancelled(Exception):
+    pass
+
+# 停止向output_file写入，之后的write与commit抛出TaskCancelled(由续租线程在租约丢失时调用)
+def cancel(output_file):
+    with cancelled_lock:
+        cancelled.add(output_file)
+
+def is_cancelled(output_file):
+    with cancelled_lock:
+        return output_file in cancelled
+
+# 流式写入爬取结果：每页解析后立即追加到临时文件(输出文件名加.part)并刷新到磁盘，任务中途失败时已爬取的页不会丢失
+# 全部完成后原子地重命名为输出文件，因此输出文件存在即表示该任务已完整爬取
+# 每写完一页在检查点文件(输出文件名加.ckpt)中记录已完成的页数、每页文献数、已写入的文献数与临时文件长度，
+# 重新运行同一任务时从检查点继续，self.page为已完成的页数，爬取应从第self.page + 1页开始
+# 传入dedup(dedup.DedupStore)与task(期刊, 起始年, 结束年)时每页写入前按文献指纹去掉之前已爬取过的文献，self.dropped为去掉的文献数
+class RowSink(object):
+    def __init__(self, output_file, columns=page_parser.columns, page_size=50, dedup=None, task=None):
+        self.output_file = output_file
+        self.columns = columns
+        self.dedup = dedup if task is not None else None
+        self.task = task
+        self.dropped = 0
+        self.part_file = output_file + '.part'
+        self.ckpt_file = output_file + '.ckpt'
+        self.page_size = page_size
+        self.page = self.rows = 0
+        # 重新认领之前失去租约的任务时允许再次写入
+        with cancelled_lock:
+            cancelled.discard(output_file)
+
+        ckpt = self.load_checkpoint()
+        if ckpt is not None:
+            # 截掉检查点之后写了一半的页，避免重复
+            self.page, self.rows = ckpt['page'], ckpt['rows']
+            os.truncate(self.part_file, ckpt['offset'])
+            self.f = open(self.part_file, 'a', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.f)
+            print('Resume from page {}, rows written: {}. File: {}.'.format(self.page + 1, self.rows, output_file))
+            if self.dedup is not None:
+                self.dedup.truncate(task, self.page)
+        else:
+            self.f = open(self.part_file, 'w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.f)
+            self.writer.writerow(columns)
+            if self.dedup is not None:
+                self.dedup.truncate(task, 0)
+
+    # 读取检查点，检查点不存在、与临时文件不一致或每页文献数不同时返回None
+    def load_checkpoint(self):
+        if not (os.path.isfile(self.ckpt_file) and os.path.isfile(self.part_file)):
+            return None
+        try:
+            with open(self.ckpt_file, 'r', encoding='utf-8') as f:
+                ckpt = json.load(f)
+        except ValueError:
+            return None
+        if ckpt.get('page_size') != self.page_size or os.path.getsize(self.part_file) < ckpt.get('offset', 0):
+            return None
+        return ckpt
+
+    # 原子地更新检查点
+    def save_checkpoint(self):
+        ckpt = {'page': self.page, 'page_size': self.page_size, 'rows': self.rows, 'offset': self.f.tell()}
+        tmp_file = self.ckpt_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(ckpt, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.ckpt_file)
+
+    # 追加一页的文献，每篇文献为按columns顺序排列的元组
+    def write(self, rows):
+        self.check_cancelled()
+        if self.dedup is not None:
+            new_rows = self.dedup.filter(rows, self.task, self.page + 1, self.columns)
+            self.dropped += len(rows) - len(new_rows)
+            rows = new_rows
+        self.writer.writerows(rows)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.rows += len(rows)
+        self.page += 1
+        self.save_checkpoint()
+
+    # 任务已被其他工作进程接管时停止写入，不删除临时文件(已由接管的进程使用)
+    def check_cancelled(self):
+        if is_cancelled(self.output_file):
+            self.close()
+            raise TaskCancelled('Lease lost, stop writing {}'.format(self.output_file))
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.ckpt_file):
+            os.remove(self.ckpt_file)
+
+    # 关闭临时文件并重命名为输出文件
+    def finalize(self):
+        self.close()
+        os.replace(self.part_file, self.output_file)
+        self.remove_checkpoint()
+
+    # 任务的所有页都已写入：有文献时重命名为输出文件并返回True
+    # 所有文献都是重复文献时默认放弃本次结果并返回False(如去重索引中的文献来自其他任务的错误登记)，
+    # 去重索引允许时仍保留只有表头的输出文件，表示该任务已完成；没有任何文献时放弃本次结果
+    def commit(self):
+        self.close()
+        self.check_cancelled()
+        if self.rows or (self.dropped and self.dedup.allow_duplicates_only):
+            self.finalize()
+            return True
+        if self.dropped:
+            print('All {} papers are duplicates, task is not marked as finished. File: {}.'.format(self.dropped, self.output_file))
+        self.discard()
+        return False
+
+    # 放弃本次结果，删除临时文件
+    def discard(self):
+        self.close()
+        if os.path.exists(self.part_file):
+            os.remove(self.part_file)
+        self.remove_checkpoint()
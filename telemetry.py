@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+import contextlib
+
+# 各阶段耗时的直方图分桶(秒)
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# 分阶段计时：每个阶段(如启动浏览器、检索、翻页等待、提取、写入)用span计时，
+# 在进程内按阶段累计次数、总耗时与直方图，配置后由后台线程把每个span以一行json追加到spans_path，
+# 并定期把累计结果以Prometheus文本格式写入metrics_dir下的crawl_<进程号>.prom(可由node_exporter的textfile collector采集)
+class Telemetry(object):
+    def __init__(self):
+        self.spans_path = None
+        self.metrics_dir = None
+        self.interval = 5  # 写入指标文件的间隔(秒)
+        self.lock = threading.Lock()
+        self.stats = {}  # 阶段名 -> [次数, 总耗时, 各分桶的次数]
+        self.counters = {}  # 计数名 -> 累计值(如传输的字节数)
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = os.getpid()
+
+    def configure(self, spans_path=None, metrics_dir=None, interval=5):
+        self.spans_path = spans_path or None
+        self.metrics_dir = metrics_dir or None
+        self.interval = interval
+        if self.metrics_dir and not os.path.exists(self.metrics_dir):
+            os.makedirs(self.metrics_dir, exist_ok=True)
+        self.start()
+
+    # 启动后台写入线程，fork出的子进程中线程不存在，需要重新启动
+    def start(self):
+        if not (self.spans_path or self.metrics_dir):
+            return
+        if self.thread is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def record(self, name, start, duration, attrs):
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, [0] * len(BUCKETS)]
+            stat[0] += 1
+            stat[1] += duration
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    stat[2][i] += 1
+        if self.spans_path:
+            self.start()
+            event = {'name': name, 'start': round(start, 6), 'duration': round(duration, 6), 'pid': os.getpid()}
+            event.update(attrs)
+            self.queue.put(event)
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # 后台线程：批量写入span，并定期写入指标文件，队列中的Event表示flush请求
+    def run(self):
+        next_time = time.time() + self.interval
+        while True:
+            items = []
+            try:
+                items.append(self.queue.get(timeout=max(0.0, next_time - time.time())))
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            events = [item for item in items if not isinstance(item, threading.Event)]
+            flushes = [item for item in items if isinstance(item, threading.Event)]
+            if events and self.spans_path:
+                with open(self.spans_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events))
+            if flushes or time.time() >= next_time:
+                self.write_metrics()
+                next_time = time.time() + self.interval
+            for done in flushes:
+                done.set()
+
+    # 以Prometheus文本格式原子地写入累计的各阶段耗时
+    def write_metrics(self):
+        if not self.metrics_dir:
+            return
+        with self.lock:
+            stats = dict((name, (stat[0], stat[1], list(stat[2]))) for name, stat in self.stats.items())
+            counters = dict(self.counters)
+        pid = os.getpid()
+        lines = ['# HELP crawl_phase_seconds Time spent in each phase of crawling.', '# TYPE crawl_phase_seconds histogram']
+        for name in sorted(stats):
+            count, total, buckets = stats[name]
+            for bound, num in zip(BUCKETS, buckets):
+                lines.append('crawl_phase_seconds_bucket{{phase="{}",pid="{}",le="{}"}} {}'.format(name, pid, bound, num))
+            lines.append('crawl_phase_seconds_bucket{{phase="{}",pid="{}",le="+Inf"}} {}'.format(name, pid, count))
+            lines.append('crawl_phase_seconds_sum{{phase="{}",pid="{}"}} {:.6f}'.format(name, pid, total))
+            lines.append('crawl_phase_seconds_count{{phase="{}",pid="{}"}} {}'.format(name, pid, count))
+        for name in sorted(counters):
+            lines.append('# TYPE crawl_{}_total counter'.format(name))
+            lines.append('crawl_{}_total{{pid="{}"}} {}'.format(name, pid, counters[name]))
+        path = os.path.join(self.metrics_dir, 'crawl_{}.prom'.format(pid))
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    # 等待已记录的span与指标写入文件
+    def flush(self, timeout=10):
+        if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+    # 各阶段的次数、总耗时与平均耗时，没有记录时返回None
+    def summary(self):
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda item: -item[1][1])
+        if not items:
+            return None
+        return 'Phases: ' + ', '.join('{}: {:.1f}s/{} (avg {:.3f}s)'.format(name, stat[1], stat[0], stat[1] / stat[0])
+                                       for name, stat in items)
+
+# 每个进程一个计时器
+telemetry = Telemetry()
+atexit.register(telemetry.flush)
+
+def configure(spans_path=None, metrics_dir=None, interval=5):
+    telemetry.configure(spans_path, metrics_dir, interval)
+
+# 对with语句块计时，attrs为写入span的附加信息(如期刊名、页码)，语句块中可向返回的字典添加信息
+@contextlib.contextmanager
+def span(name, **attrs):
+    start = time.time()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        telemetry.record(name, start, time.time() - start, attrs)
+
+# 累加计数，随指标一起写入
+def add(name, value=1):
+    telemetry.add(name, value)
+
+def flush():
+    telemetry.flush()
+
+def summary():
+    return telemetry.summary()
+
+# 用于记录屏幕输出：同时输出到屏幕与日志文件，写日志文件由后台线程完成，不阻塞爬取
+class Logger(object):
+    def __init__(self, filename):
+        self.terminal = sys.stdout
+        self.filename = filename
+        self.pid = None
+        self.start()
+
+    # 启动写日志线程，fork出的子进程中线程不存在，需要重新启动
+    def start(self):
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.log = open(self.filename, "a")
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def write(self, message):
+        if self.pid != os.getpid():
+            self.start()
+        self.terminal.write(message)
+        self.queue.put(message)
+
+    def run(self):
+        while True:
+            messages = [self.queue.get()]
+            while True:
+                try:
+                    messages.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.log.write(''.join(messages))
+            self.log.flush()
+            for _ in messages:
+                self.queue.task_done()
+
+    # 等待已输出的内容写入日志文件
+    def flush(self):
+        self.terminal.flush()
+        if self.pid == os.getpid():
+            self.queue.join()
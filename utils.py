@@ -5,6 +5,19 @@ import shutil
 from pathlib import Path
 import pandas as pd
 import collections
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import heapq
+import pickle
+import tempfile
+import openpyxl
+
+try:
+    import pyarrow  # 列式缓存优先使用feather格式，需要pyarrow
+except ImportError:
+    pyarrow = None
 
 # 从src(excel文件)中读取期刊名称，读取结果保存到dst中
 def excel2txt(src, dst):
@@ -31,82 +44,365 @@ def read_txt(filename, start, end):
             line = f.readline()
     return result
          
+# 爬取结果文件的扩展名，旧版本输出xlsx，现在流式输出csv
+output_exts = ('.csv', '.xlsx')
+
+# 检查任务的输出文件(csv或xlsx)是否已存在
+def output_exists(output_file):
+    return find_output(output_file) is not None
+
+# 任务输出文件(csv或xlsx)的实际路径，不存在时返回None
+def find_output(output_file):
+    stem = os.path.splitext(output_file)[0]
+    for ext in output_exts:
+        if Path(stem + ext).is_file():
+            return stem + ext
+    return None
+
+# 读取爬取结果文件(csv或xlsx)
+def read_table(file_name):
+    if file_name.endswith('.csv'):
+        return pd.read_csv(file_name, dtype=str, keep_default_na=False)
+    return pd.read_excel(file_name)
+
+# 合并时每个输入文件读取后的列式缓存目录(feather，没有pyarrow时为pickle)，以文件路径、修改时间与大小判断缓存是否有效
+merge_cache_dir = './.merge_cache'
+
+# 文件签名(修改时间与大小)
+def file_signature(file_name):
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+# 读取缓存清单，files记录每个已缓存文件的签名，outputs记录每个合并结果所用输入文件的签名
+def load_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'files': {}, 'outputs': {}}
+
+def save_manifest(cache_dir, manifest):
+    manifest_file = os.path.join(cache_dir, 'manifest.json')
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+# 读取一个文件，fresh为True时直接读取缓存，否则读取原文件并写入缓存(在进程池中执行)
+def read_cached(file_name, cache_stem, fresh):
+    if fresh:
+        for ext, reader in (('.feather', pd.read_feather), ('.pkl', pd.read_pickle)):
+            if os.path.isfile(cache_stem + ext):
+                try:
+                    return reader(cache_stem + ext)
+                except Exception:
+                    break
+    df = read_table(file_name)
+    for ext in ('.feather', '.pkl'):
+        if os.path.exists(cache_stem + ext):
+            os.remove(cache_stem + ext)
+    try:
+        if pyarrow is None:
+            raise ImportError('pyarrow is not installed')
+        df.reset_index(drop=True).to_feather(cache_stem + '.feather')
+    except Exception:
+        # 列中混有数字与字符串等feather不支持的情况改用pickle
+        if os.path.exists(cache_stem + '.feather'):
+            os.remove(cache_stem + '.feather')
+        df.to_pickle(cache_stem + '.pkl')
+    return df
+
+# 用workers个进程并行读取files中的文件，未修改的文件直接读取缓存，返回与files顺序相同的DataFrame列表
+def read_tables(files, cache_dir=None, workers=None):
+    cache_dir = cache_dir or merge_cache_dir
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    args = []
+    for file_name in files:
+        key = os.path.abspath(file_name)
+        cache_stem = os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+        signature = file_signature(file_name)
+        args.append((file_name, cache_stem, manifest['files'].get(key) == signature))
+        manifest['files'][key] = signature
+    if workers == 1 or len(args) <= 1:
+        dfs = [read_cached(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            dfs = list(executor.map(read_cached, *zip(*args), chunksize=16))
+    save_manifest(cache_dir, manifest)
+    return dfs
+
+# 合并结果所用输入文件的签名
+def inputs_signature(files):
+    return sorted([os.path.abspath(file_name)] + file_signature(file_name) for file_name in files)
+
+# 合并结果out_path不存在或所用输入文件与上次合并时(记录在manifest中)不同时需要重新合并
+def inputs_changed(out_path, files, manifest):
+    return not Path(out_path).is_file() or manifest['outputs'].get(os.path.abspath(out_path)) != inputs_signature(files)
+
+# 记录合并结果out_path所用输入文件的签名
+def record_inputs(outputs, cache_dir=None):
+    cache_dir = cache_dir or merge_cache_dir
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    for out_path, files in outputs.items():
+        manifest['outputs'][os.path.abspath(out_path)] = inputs_signature(files)
+    save_manifest(cache_dir, manifest)
+
+# 将src目录下的csv爬取结果转换为xlsx，保存到dst目录下
+def csv2excel(src, dst):
+    if not os.path.exists(dst):
+        os.mkdir(dst)
+    for file in os.listdir(src):
+        if file.endswith('.csv'):
+            df = read_table(os.path.join(src, file))
+            df.to_excel(os.path.join(dst, file[:-4] + '.xlsx'))
+
 # 找出src目录下的文件相比target多出与缺失的文件，将多出的文件移动到dst目录下 
 def find_extra_missing(src, target, dst):
     if not os.path.exists(dst):
         os.mkdir(dst)
 
-    src_files = set(os.listdir(src))
-    target_files = set([journal + str(i + 1) + '.xlsx' for journal in target for i in range(3)])
+    # 未完成任务的临时文件(.part)与检查点(.ckpt)不算作多出的文件
+    src_files = set(file for file in os.listdir(src) if not file.endswith(('.part', '.ckpt')))
+    src_stems = set(os.path.splitext(file)[0] for file in src_files)
+    target_stems = set([journal + str(i + 1) for journal in target for i in range(3)])
     moved_files, missing_files = [], []
     for src_file in src_files:
-        if src_file not in target_files:
-            shutil.move(src + '/' + src_ｆile, dst)
+        if os.path.splitext(src_file)[0] not in target_stems:
+            shutil.move(src + '/' + src_file, dst)
             moved_files.append(src_file)
             print('extra file: {}, moved: {}, total: {}'.format(src_file, len(moved_files), len(src_files)))
-    for target_file in target_files:
-        if target_file not in src_files:
-            missing_files.append(target_file)
-            print('missing file: {}, missing: {}, total: {}'.format(target_file, len(missing_files), len(target_files)))
+    for target_stem in target_stems:
+        if target_stem not in src_stems:
+            missing_files.append(target_stem + '.csv')
+            print('missing file: {}, missing: {}, total: {}'.format(target_stem + '.csv', len(missing_files), len(target_stems)))
     return moved_files, missing_files
 
+# 外部归并排序时每个排序块的行数
+MERGE_CHUNK_ROWS = 50000
+# 一个期刊的输入文件总大小超过该值(字节)时使用外部归并，不把所有文献读入内存
+STREAM_MERGE_BYTES = 64 * 1024 * 1024
+
+# 读取爬取结果文件的表头，不读取数据
+def read_header(file_name):
+    if file_name.endswith('.csv'):
+        with open(file_name, 'r', newline='', encoding='utf-8') as f:
+            return next(csv.reader(f), [])
+    wb = openpyxl.load_workbook(file_name, read_only=True)
+    try:
+        return list(next(wb.active.iter_rows(max_row=1, values_only=True), ()))
+    finally:
+        wb.close()
+
+# 合并结果的列：按出现顺序合并各文件的列，去掉pandas写入的行号列
+def merge_columns(files, index_label='序号'):
+    columns = []
+    for file_name in files:
+        for col in read_header(file_name):
+            if col is None or str(col).startswith('Unnamed') or col == index_label or col in columns:
+                continue
+            columns.append(col)
+    return columns
+
+# 逐行读取爬取结果文件，每行按columns的顺序返回，缺少的列为None
+def iter_table_rows(file_name, columns):
+    if file_name.endswith('.csv'):
+        with open(file_name, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            indexes = [header.index(col) if col in header else None for col in columns]
+            for row in reader:
+                yield [row[i] if i is not None and i < len(row) else None for i in indexes]
+        return
+    wb = openpyxl.load_workbook(file_name, read_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        indexes = [header.index(col) if col in header else None for col in columns]
+        for row in rows:
+            yield [row[i] if i is not None and i < len(row) else None for i in indexes]
+    finally:
+        wb.close()
+
+# 排序键，空值排在最前
+def sort_key(value):
+    return '' if value is None else str(value)
+
+# 将排好序的块写入临时文件
+def spill(chunk, tmp_dir):
+    fd, path = tempfile.mkstemp(suffix='.chunk', dir=tmp_dir)
+    with os.fdopen(fd, 'wb') as f:
+        for row in chunk:
+            pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+    return path
+
+def iter_spill(path):
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+# 外部归并：逐行读取files，每MERGE_CHUNK_ROWS行按sort_by排序后写入临时文件，再用heapq多路归并，
+# 以openpyxl的write-only模式流式写入out_path，内存占用只与块大小有关，与输入总量无关
+# sort_by为None时不排序，unique_by不为None时只保留该列每个值第一次出现的行，返回写入的行数
+def external_merge(files, out_path, sort_by='发表时间', unique_by=None, chunk_rows=None, index_label='序号'):
+    columns = merge_columns(files, index_label)
+    chunk_rows = chunk_rows or MERGE_CHUNK_ROWS
+    key_index = columns.index(sort_by) if sort_by in columns else None
+    unique_index = columns.index(unique_by) if unique_by in columns else None
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as tmp_dir:
+        rows = (row for file_name in files for row in iter_table_rows(file_name, columns))
+        if key_index is not None:
+            chunks, chunk = [], []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    chunk.sort(key=lambda row: sort_key(row[key_index]))
+                    chunks.append(spill(chunk, tmp_dir))
+                    chunk = []
+            chunk.sort(key=lambda row: sort_key(row[key_index]))
+            chunks.append(spill(chunk, tmp_dir))
+            del chunk
+            rows = heapq.merge(*[iter_spill(path) for path in chunks], key=lambda row: sort_key(row[key_index]))
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        ws.append([index_label] + columns)
+        seen = set()
+        num = 0
+        for row in rows:
+            if unique_index is not None:
+                if row[unique_index] in seen:
+                    continue
+                seen.add(row[unique_index])
+            num += 1
+            ws.append([num] + row)
+        wb.save(out_path)
+    return num
+
+# 将一个期刊的所有DataFrame合并后按发表时间排序，保存到out_path
+def write_merged(dfs, out_path):
+    df_concated = pd.concat(dfs)
+    #df_concated.drop_duplicates(subset=['篇名'], keep='first', inplace=True)
+    df_concated = df_concated.loc[:, ~df_concated.columns.str.contains('Unnamed')]
+    df_concated = df_concated.sort_values(by='发表时间')
+    df_concated.index = range(1, len(df_concated) + 1)
+    df_concated.to_excel(out_path, sheet_name='Sheet1', index_label='序号')
+
+# 将一个期刊的输出文件files合并为out_path，输入文件没有变化时不重新合并，返回是否重新合并
+def merge_journal(files, out_path, cache_dir=None, streaming=False):
+    if not inputs_changed(out_path, files, load_manifest(cache_dir or merge_cache_dir)):
+        return False
+    if streaming or sum(os.path.getsize(file_name) for file_name in files) > STREAM_MERGE_BYTES:
+        external_merge(files, out_path, sort_by='发表时间')
+    else:
+        write_merged(read_tables(files, cache_dir, workers=1), out_path)
+    record_inputs({out_path: files}, cache_dir)
+    return True
+
 # 将src目录下的文件按期刊名合并，合并后的文件保存到dst目录下
-def merge_journals(src, dst):
+# 输入文件在workers个进程中并行读取并缓存，只重新合并输入文件有变化的期刊
+# 输入文件总大小超过STREAM_MERGE_BYTES的期刊(streaming为True时为所有期刊)使用外部归并，内存占用不随输入大小增长
+def merge_journals(src, dst, workers=None, cache_dir=None, streaming=False):
     print('Start merging files in {}'.format(src))
     if not os.path.exists(dst):
         os.mkdir(dst)
 
-    file2df = collections.defaultdict(list)
+    journal2files = collections.defaultdict(list)
     num_before = num_after = 0
-    # 遍历文件目录，将所有表格表示为pandas中的DataFrame对象
+    # 遍历文件目录，按期刊名对文件分组
     for root_dir, sub_dir, files in os.walk(src):
         for file in files:
             num_before += 1
-            if file.endswith('xlsx'):
+            if file.endswith(output_exts):
             	# 构造绝对路径
                 file_name = os.path.join(root_dir, file)
-                df = pd.read_excel(file_name)
-                journal_file = file[:-6] + '.xlsx'
-                file2df[journal_file].append(df)
-    num_after = len(file2df)
-
-    for file in file2df:
-        df_concated = pd.concat(file2df[file])
-        #df_concated.drop_duplicates(subset=['篇名'], keep='first', inplace=True)
-        out_path = os.path.join(dst, file)
-        df_concated = df_concated.loc[:, ~df.columns.str.contains('Unnamed')]
-        df_concated = df_concated.sort_values(by='发表时间')
-        df_concated.index = range(1, len(df_concated) + 1)
-        df_concated.to_excel(out_path, sheet_name='Sheet1', index_label='序号')
+                journal_file = os.path.splitext(file)[0][:-1] + '.xlsx'
+                journal2files[journal_file].append(file_name)
+    num_after = len(journal2files)
+
+    # 只读取输入文件有变化的期刊的文件
+    manifest = load_manifest(cache_dir or merge_cache_dir)
+    changed = [file for file in journal2files if inputs_changed(os.path.join(dst, file), journal2files[file], manifest)]
+    large = set(file for file in changed
+                if streaming or sum(os.path.getsize(file_name) for file_name in journal2files[file]) > STREAM_MERGE_BYTES)
+    for file in changed:
+        if file in large:
+            external_merge(journal2files[file], os.path.join(dst, file), sort_by='发表时间')
 
-    print('Finish merging files in {}. There are {} files before merge, {} files after merge.'.format(src, num_before, num_after))    
+    files = [file_name for file in changed if file not in large for file_name in journal2files[file]]
+    dfs = iter(read_tables(files, cache_dir, workers))
+    for file in changed:
+        if file in large:
+            continue
+        write_merged([next(dfs) for _ in journal2files[file]], os.path.join(dst, file))
+    record_inputs(dict((os.path.join(dst, file), journal2files[file]) for file in changed), cache_dir)
 
-# 将src目录下的所有文件合并，合并后的文件保存到dst目录下
-def merge_publish_numbers(src, dst):
+    print('Finish merging files in {}. There are {} files before merge, {} files after merge, {} re-merged.'.format(
+        src, num_before, num_after, len(changed)))    
+
+# 将src目录下的所有文件合并，合并后的文件保存到dst目录下，输入文件没有变化时不重新合并
+# streaming为True时逐行流式写入，不把所有文件读入内存
+def merge_publish_numbers(src, dst, workers=None, cache_dir=None, streaming=False):
     print('Start merging files in {}'.format(src))
     if not os.path.exists(dst):
         os.mkdir(dst)
     
-    res = []
+    files = []
     num_before = 0
     # 遍历文件目录，将所有表格表示为pandas中的DataFrame对象
-    for root_dir, sub_dir, files in os.walk(src):
-        for file in files:
+    for root_dir, sub_dir, file_names in os.walk(src):
+        for file in file_names:
             num_before += 1
             if file.endswith('xlsx'):
             	# 构造绝对路径
-                file_name = os.path.join(root_dir, file)
-                df = pd.read_excel(file_name)
-                res.append(df)
+                files.append(os.path.join(root_dir, file))
 
-    df_concated = pd.concat(res)
-    df_concated.drop_duplicates(subset=['期刊名称'], keep='first', inplace=True)
-    df_concated = df_concated.loc[:, ~df.columns.str.contains('Unnamed')]
     output_file = os.path.join(dst, '发表数量.xlsx')
-    df_concated.index = range(1, len(df_concated) + 1)
-    df_concated.to_excel(output_file, sheet_name='Sheet1', index_label='序号')
+    if not inputs_changed(output_file, files, load_manifest(cache_dir or merge_cache_dir)):
+        print('Files in {} are not changed since last merge.'.format(src))
+        return
+    if streaming:
+        external_merge(files, output_file, sort_by=None, unique_by='期刊名称')
+    else:
+        res = read_tables(files, cache_dir, workers)
+        df_concated = pd.concat(res)
+        df_concated.drop_duplicates(subset=['期刊名称'], keep='first', inplace=True)
+        df_concated = df_concated.loc[:, ~df_concated.columns.str.contains('Unnamed')]
+        df_concated.index = range(1, len(df_concated) + 1)
+        df_concated.to_excel(output_file, sheet_name='Sheet1', index_label='序号')
+    record_inputs({output_file: files}, cache_dir)
     print('Finish merging files in {}. There are {} files before merge.'.format(src, num_before))  
 
+# 将src目录下各任务的发表数量(期刊名称、各年份、总数)按期刊合并，每个期刊保存为dst目录下的一个excel文件，
+# 格式与crawl_publish_num.py的输出相同，总数为各年份范围总数之和
+def combine_year_counts(src, dst):
+    if not os.path.exists(dst):
+        os.mkdir(dst)
+    journals = collections.OrderedDict()
+    for file in sorted(os.listdir(src)):
+        if file.endswith('.csv'):
+            df = pd.read_csv(os.path.join(src, file), encoding='utf-8')
+            journals.setdefault(df['期刊名称'][0], []).append(df)
+    for journal, dfs in journals.items():
+        info = collections.OrderedDict()
+        info['期刊名称'] = journal
+        total = 0
+        for df in dfs:
+            for col in df.columns:
+                if col not in ('期刊名称', '总数'):
+                    info[str(col)] = int(df[col][0])
+            total += int(df['总数'][0])
+        years = sorted(col for col in info if col != '期刊名称')
+        info = collections.OrderedDict([('期刊名称', journal)] + [(year, info[year]) for year in years] + [('总数', total)])
+        pd.DataFrame(data=[info]).to_excel(os.path.join(dst, journal + '.xlsx'))
+    print('Finish combining publish numbers in {}. Journals: {}'.format(src, len(journals)))
+
 # 检查每个期刊2012年-2020年总文献数量是否符合预期，返回不符合预期的期刊名列表
 def check_publish_numbers(src, dst):
     print('Start checking files in {}'.format(src))
@@ -136,8 +432,13 @@ if __name__ == '__main__':
     excel2txt('./待爬取数据.xlsx', './journals.txt')
     target = read_txt('./journals.txt', start, end)
 
-    moved_files, missing_files = find_extra_missing(src, target, './others')
-    print('extra files: {}'.format(moved_files))
+    if Path('./tasks.db').is_file():
+        # 由任务账本查询未完成的任务，不再扫描与移动输出目录中的文件
+        from ledger import Ledger
+        missing_files = [output for _, _, _, output in Ledger('./tasks.db').missing(target)]
+    else:
+        moved_files, missing_files = find_extra_missing(src, target, './others')
+        print('extra files: {}'.format(moved_files))
     print('missing files: {}'.format(missing_files))
     
     merge_journals(src, dst)